@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from concurrent request threads and runs them
+    through `fn` in batches on a single worker thread.
+
+    A batch is closed when `max_batch_size` items are queued or when
+    `max_wait` seconds have passed since the oldest queued item arrived.
+    `fn` receives a list of items and must return a list of results in the
+    same order.
+    """
+
+    def __init__(
+        self,
+        fn,
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+        name: str = "batcher",
+    ):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.name = name
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._size_histogram = {}
+        self._recent = deque(maxlen=100)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        with self._cond:
+            self._queue.append((item, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _next_batch(self) -> list:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            items = [item for item, _, _ in batch]
+            started = time.monotonic()
+            try:
+                results = list(self.fn(items))
+                # Results can't be matched to their inputs if some are missing,
+                # and a caller left without one would wait forever
+                if len(results) != len(batch):
+                    raise ValueError(
+                        f"Batch function returned {len(results)} results "
+                        f"for {len(batch)} inputs"
+                    )
+                failed = False
+            except Exception as e:
+                results = None
+                failed = True
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            finished = time.monotonic()
+            if not failed:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            self._record(batch, started, finished, failed)
+
+    def _record(self, batch: list, started: float, finished: float, failed: bool):
+        size = len(batch)
+        wait = sum(started - enqueued for _, _, enqueued in batch) / size
+        run = finished - started
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._errors += 1 if failed else 0
+            self._total_wait += wait
+            self._total_run += run
+            self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+            self._recent.append(
+                {
+                    "size": size,
+                    "wait_ms": round(wait * 1000, 3),
+                    "run_ms": round(run * 1000, 3),
+                    "failed": failed,
+                }
+            )
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            batches = self._batches or 1
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queued": len(self._queue),
+                "batches": self._batches,
+                "items": self._items,
+                "errors": self._errors,
+                "avg_batch_size": self._items / batches,
+                "avg_wait_ms": self._total_wait / batches * 1000,
+                "avg_run_ms": self._total_run / batches * 1000,
+                "batch_sizes": dict(sorted(self._size_histogram.items())),
+                "recent": list(self._recent),
+            }
+
+
+def run_length_sorted(fn, texts: list, batch_size: int) -> list:
+    """
+    Runs `fn` over `texts` in batches of similar length, so short texts are not
+    padded to the longest one, and returns the results in the input order.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    results = [None] * len(texts)
+    for start in range(0, len(order), max(1, batch_size)):
+        indices = order[start : start + batch_size]
+        outputs = fn([texts[i] for i in indices])
+        for i, output in zip(indices, outputs):
+            results[i] = output
+    return results
@@ -0,0 +1,94 @@
+"""
+Measures the round trips the remote SD client saves on the metadata the
+UI polls (model list, sampler list and current model), against a local
+stub of the WebUI API.
+
+    python benchmarks/sd_remote_bench.py --polls 200 --threads 8 --latency 20
+
+Pass --host and --port to run against a real WebUI instead of the stub.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import webuiapi
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sd_remote_client import RemoteSDClient
+from sd_remote_stub import start_stub
+
+
+def poll(api):
+    api.util_get_model_names()
+    api.get_samplers()
+    api.util_get_current_model()
+
+
+def stub_stats(api) -> dict:
+    return api.session.get(f"{api.baseurl.rsplit('/sdapi', 1)[0]}/stub/stats").json()
+
+
+def run(name: str, api, stats_api, args) -> dict:
+    before = stub_stats(stats_api) if stats_api else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(lambda _: poll(api), range(args.polls)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "name": name,
+        "total_s": elapsed,
+        "per_poll_ms": elapsed / args.polls * 1000,
+    }
+    if stats_api:
+        after = stub_stats(stats_api)
+        result["backend_requests"] = after["requests"] - before["requests"] - 1
+        result["connections"] = after["connections"] - before["connections"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", help="Use a real WebUI instead of the stub")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--latency", type=float, default=20, help="Stub milliseconds")
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--cache-ttl", type=float, default=30)
+    args = parser.parse_args()
+
+    if args.host:
+        host, port = args.host, args.port
+    else:
+        server = start_stub(0, args.latency / 1000)
+        host, port = "127.0.0.1", server.server_port
+
+    def api():
+        return webuiapi.WebUIApi(host=host, port=port)
+
+    stats_api = None if args.host else api()
+    results = [
+        run("webuiapi", api(), stats_api, args),
+        run("pooled", RemoteSDClient(api(), cache_ttl=0), stats_api, args),
+        run(
+            "pooled + cache",
+            RemoteSDClient(api(), cache_ttl=args.cache_ttl),
+            stats_api,
+            args,
+        ),
+    ]
+
+    print(f"{args.polls} polls of 3 requests from {args.threads} threads")
+    columns = [key for key in results[0] if key != "name"]
+    print(f"{'':18}" + "".join(f"{column:>18}" for column in columns))
+    for result in results:
+        print(
+            f"{result['name']:18}"
+            + "".join(f"{result[column]:>18.2f}" for column in columns)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Minimal stand-in for the Stable Diffusion WebUI API, with a configurable
+latency per request, to measure the remote SD client without a GPU.
+
+    python benchmarks/sd_remote_stub.py --port 7861 --latency 20
+
+GET /stub/stats returns the number of connections and requests served.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1x1 PNG
+IMAGE = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAAB"
+    "JRU5ErkJggg=="
+)
+MODELS = ["anything-v4.5.safetensors [1d1e459f9f]", "sd-v1-5.ckpt [e1441589a6]"]
+SAMPLERS = ["Euler a", "Euler", "DDIM", "DPM++ 2M Karras"]
+
+
+class StubState:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.model = MODELS[0]
+        self.interrupted = False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep-alive
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _begin(self):
+        with self.state.lock:
+            self.state.requests += 1
+        time.sleep(self.state.latency)
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def do_GET(self):
+        self._begin()
+        if self.path == "/sdapi/v1/sd-models":
+            self._send(
+                [
+                    {"title": m, "model_name": m.split(" ")[0].rsplit(".", 1)[0]}
+                    for m in MODELS
+                ]
+            )
+        elif self.path == "/sdapi/v1/samplers":
+            self._send([{"name": s, "aliases": [], "options": {}} for s in SAMPLERS])
+        elif self.path == "/sdapi/v1/options":
+            self._send({"sd_model_checkpoint": self.state.model})
+        elif self.path.startswith("/sdapi/v1/progress"):
+            self._send(
+                {
+                    "progress": 0.0,
+                    "eta_relative": 0.0,
+                    "state": {"job_count": 0, "sampling_step": 0, "sampling_steps": 0},
+                    "current_image": None,
+                }
+            )
+        elif self.path == "/stub/stats":
+            self._send(
+                {"connections": self.state.connections, "requests": self.state.requests}
+            )
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        data = self._begin()
+        if self.path == "/sdapi/v1/options":
+            self.state.model = data.get("sd_model_checkpoint", self.state.model)
+            self._send(None)
+        elif self.path == "/sdapi/v1/interrupt":
+            self.state.interrupted = True
+            self._send(None)
+        elif self.path == "/sdapi/v1/txt2img":
+            count = data.get("batch_size", 1)
+            seed = data.get("seed", -1)
+            seed = seed if seed >= 0 else 1
+            info = {"all_seeds": [seed + i for i in range(count)]}
+            self._send(
+                {
+                    "images": [IMAGE] * count,
+                    "parameters": data,
+                    "info": json.dumps(info),
+                }
+            )
+        else:
+            self.send_error(404)
+
+
+def start_stub(port: int = 0, latency: float = 0.02) -> ThreadingHTTPServer:
+    """Starts the stub in a background thread. Port 0 picks a free port."""
+    handler = type("Handler", (StubHandler,), {"state": StubState(latency)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--latency", type=float, default=20, help="Milliseconds")
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.latency / 1000)
+    print(f"Stub SD WebUI API listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
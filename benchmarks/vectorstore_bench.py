@@ -0,0 +1,154 @@
+"""
+Compares insert and query latency and memory of the chromadb module's
+vector store backends on random embeddings, without loading a model.
+
+    python benchmarks/vectorstore_bench.py --vectors 5000 --queries 200
+
+Each backend runs in its own process, so their RSS does not mix.
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BACKENDS = ["numpy", "chromadb"]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        # Peak RSS, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (2**20 if sys.platform == "darwin" else 1024)
+
+
+def create_store(backend: str, path: str):
+    if backend == "numpy":
+        from vectorstore import NumpyVectorStore
+
+        return NumpyVectorStore(path)
+
+    import chromadb
+    from chromadb.config import Settings
+    from vectorstore import ChromaVectorStore
+
+    client = chromadb.Client(Settings(anonymized_telemetry=False))
+    return ChromaVectorStore(client, embedding_function=None)
+
+
+def run_backend(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    ids = [f"message-{i}" for i in range(args.vectors)]
+    documents = [f"message text {i}" for i in range(args.vectors)]
+    metadatas = [
+        {
+            "role": "user" if i % 2 else "assistant",
+            "date": i,
+            "meta": "",
+            "hash": hashlib.md5(documents[i].encode()).hexdigest(),
+        }
+        for i in range(args.vectors)
+    ]
+
+    baseline = rss_mb()
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as path:
+        store = create_store(args.backend, path)
+        setup = time.perf_counter() - started
+
+        insert_times = []
+        for start in range(0, args.vectors, args.batch):
+            end = start + args.batch
+            started = time.perf_counter()
+            store.upsert(
+                "bench",
+                ids[start:end],
+                documents[start:end],
+                metadatas[start:end],
+                vectors[start:end].tolist(),
+            )
+            insert_times.append(time.perf_counter() - started)
+
+        query_times = []
+        for query in queries:
+            started = time.perf_counter()
+            store.query("bench", [query.tolist()], args.k)
+            query_times.append(time.perf_counter() - started)
+
+        filtered_times = []
+        for query in queries[: max(1, len(queries) // 10)]:
+            started = time.perf_counter()
+            store.query("bench", [query.tolist()], args.k, where={"role": "user"})
+            filtered_times.append(time.perf_counter() - started)
+
+        rss = rss_mb()
+        store.close()
+
+    return {
+        "backend": args.backend,
+        "setup_ms": setup * 1000,
+        "insert_total_s": sum(insert_times),
+        "insert_per_batch_ms": np.mean(insert_times) * 1000,
+        "query_p50_ms": np.percentile(query_times, 50) * 1000,
+        "query_p95_ms": np.percentile(query_times, 95) * 1000,
+        "filtered_query_p50_ms": np.percentile(filtered_times, 50) * 1000,
+        "rss_mb": rss,
+        "rss_growth_mb": rss - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=BACKENDS, help="Run only this backend")
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(run_backend(args)))
+        return
+
+    results = []
+    for backend in BACKENDS:
+        command = [sys.executable, __file__, "--backend", backend, "--json"]
+        for name in ["vectors", "dim", "batch", "queries", "k", "seed"]:
+            command += [f"--{name}" if len(name) > 1 else f"-{name}"]
+            command += [str(getattr(args, name))]
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode != 0:
+            print(f"{backend} failed:", process.stderr.strip().splitlines()[-1])
+            continue
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.vectors} vectors of {args.dim} dimensions, top {args.k}")
+    columns = [key for key in results[0] if key != "backend"] if results else []
+    print(f"{'':24}" + "".join(f"{r['backend']:>12}" for r in results))
+    for column in columns:
+        print(f"{column:24}" + "".join(f"{r[column]:>12.2f}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+def cache_key(*parts) -> str:
+    """Builds a content hash from a sequence of str or bytes parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, bytes):
+            part = repr(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Directory of files named by their key, bounded by total size.
+    The least recently used files are deleted first.
+    """
+
+    def __init__(self, path: str, max_bytes: int, suffix: str = ".bin"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for file in files:
+                if not file.endswith(self.suffix):
+                    continue
+                stat = os.stat(os.path.join(root, file))
+                entries.append((stat.st_mtime, file[: -len(self.suffix)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._bytes += size
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + self.suffix)
+
+    def open(self, key: str, ttl: float = None):
+        """
+        Returns the cached file opened for reading, or None. The file is
+        opened while the entry is guarded by the lock, so a concurrent set()
+        can't evict it in between, and the open file stays readable if it is
+        evicted afterwards.
+        """
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = self.path_for(key)
+            try:
+                expired = ttl is not None and time.time() - os.path.getmtime(path) > ttl
+                file = None if expired else open(path, "rb")
+            except OSError:
+                # The file is gone, so the entry is dropped
+                file = None
+            if file is None:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+            return file
+
+    def get(self, key: str, ttl: float = None):
+        file = self.open(key, ttl)
+        if file is None:
+            return None
+        try:
+            with file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, key: str, data: bytes) -> str:
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._bytes -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                self._remove(next(iter(self._index)))
+        return path
+
+    def _remove(self, key: str):
+        self._bytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self.path_for(key))
+        except OSError:
+            pass
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU cache of pickled results with optional expiry and an
+    optional DiskCache tier behind it. Entries are grouped by namespace, which
+    is also used to report hit/miss counters.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = None, disk: DiskCache = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.disk is not None
+
+    def _count(self, namespace: str, counter: str):
+        counters = self._counters.setdefault(
+            namespace, {"hits": 0, "disk_hits": 0, "misses": 0}
+        )
+        counters[counter] += 1
+
+    def get(self, namespace: str, key: str):
+        if not self.enabled:
+            return MISSING
+        full_key = f"{namespace}-{key}"
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                created, data = entry
+                if self.ttl is None or time.time() - created <= self.ttl:
+                    self._entries.move_to_end(full_key)
+                    self._count(namespace, "hits")
+                    return pickle.loads(data)
+                self._bytes -= len(data)
+                del self._entries[full_key]
+        if self.disk is not None:
+            data = self.disk.get(full_key, self.ttl)
+            if data is not None:
+                self._store(full_key, data)
+                with self._lock:
+                    self._count(namespace, "disk_hits")
+                return pickle.loads(data)
+        with self._lock:
+            self._count(namespace, "misses")
+        return MISSING
+
+    def set(self, namespace: str, key: str, value):
+        if not self.enabled:
+            return
+        full_key = f"{namespace}-{key}"
+        data = pickle.dumps(value)
+        self._store(full_key, data)
+        if self.disk is not None:
+            self.disk.set(full_key, data)
+
+    def _store(self, full_key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(full_key, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            self._entries[full_key] = (time.time(), data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get_or_compute(self, namespace: str, key: str, fn):
+        value = self.get(namespace, key)
+        if value is MISSING:
+            value = fn()
+            self.set(namespace, key, value)
+        return value
+
+    def map(self, namespace: str, keys: list, items: list, fn) -> list:
+        """
+        Looks up every key and calls `fn` once with the list of items that
+        were not cached. Returns the results in the order of `items`.
+        """
+        results = [self.get(namespace, key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is MISSING]
+        if missing:
+            computed = fn([items[i] for i in missing])
+            for i, value in zip(missing, computed):
+                results[i] = value
+                self.set(namespace, keys[i], value)
+        return results
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "namespaces": {k: dict(v) for k, v in self._counters.items()},
+            }
+        if self.disk is not None:
+            stats["disk"] = self.disk.get_stats()
+        return stats
@@ -13,7 +13,37 @@ DEFAULT_REMOTE_SD_HOST = "127.0.0.1"
 DEFAULT_REMOTE_SD_PORT = 7860
 SILERO_SAMPLES_PATH = "tts_samples"
 SILERO_SAMPLE_TEXT = "The quick brown fox jumps over the lazy dog"
+TTS_CACHE_PATH = "tts_cache"
+CHROMA_PERSIST_PATH = ".chroma_db"
+NUMPY_VECTOR_STORE_PATH = ".vector_store"
+CHROMA_SPILL_FOLDER = "spilled"
+DEFAULT_EMBEDDING_BATCH_SIZE = 32
+# Maximal marginal relevance reranking of chromadb queries
+DEFAULT_MMR_LAMBDA = 0.5
+DEFAULT_MMR_FETCH_FACTOR = 4
+# Seconds
+DEFAULT_CHROMA_FLUSH_INTERVAL = 300
+# Megabytes
+DEFAULT_TTS_CACHE_SIZE = 256
+# Seconds
+TTS_AUDIO_MAX_AGE = 24 * 60 * 60
 DEFAULT_FASTER_WHISPER_MODEL = "medium.en"
+DEFAULT_TRANSCRIBE_COMPUTE_TYPE = {"cpu": "int8", "cuda": "float16"}
+DEFAULT_TRANSCRIBE_BEAM_SIZE = 5
+# Seconds
+DEFAULT_TRANSCRIBE_WINDOW = 120
+DEFAULT_TRANSCRIBE_OVERLAP = 2
+MIN_TRANSCRIBE_WINDOW = 10
+DEFAULT_MAX_BATCH_SIZE = 8
+# Milliseconds
+DEFAULT_BATCH_WINDOW = 10
+DEFAULT_STARTUP_WORKERS = 4
+# Bytes
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Megabytes
+DEFAULT_CACHE_SIZE = 64
+DEFAULT_CACHE_DISK_SIZE = 1024
 
 # ALL_MODULES = ['caption', 'summarize', 'classify', 'keywords', 'prompt', 'sd']
 DEFAULT_SUMMARIZE_PARAMS = {
@@ -22,6 +52,7 @@ DEFAULT_SUMMARIZE_PARAMS = {
     "max_length": 500,
     "min_length": 200,
     "length_penalty": 1.5,
+    "reduce": False,
     "bad_words": [
         "\n",
         '"',
@@ -43,6 +74,32 @@ DEFAULT_SUMMARIZE_PARAMS = {
     ],
 }
 
+# Tokens per chunk of chat messages summarized by the incremental mode
+DEFAULT_INCREMENTAL_CHUNK_TOKENS = 256
+MAX_INCREMENTAL_SUMMARY_CHATS = 256
+
+# Stable Diffusion job queue
+DEFAULT_SD_QUEUE_SIZE = 16
+SD_JOB_HISTORY = 32
+# Seconds between progress polls of the remote backend
+SD_PROGRESS_INTERVAL = 0.5
+SD_DEBUG_IMAGE_PATH = "./debug.png"
+# Default encoder quality of generated images and caption thumbnails
+SD_IMAGE_QUALITY = 90
+THUMBNAIL_QUALITY = 75
+IMAGE_ENCODER_WORKERS = 4
+# Images per request, and the largest seed accepted
+SD_MAX_IMAGES = 4
+SD_MAX_SEED = 2**32 - 1
+# Megabytes of encoded images of local SD requests with explicit seeds
+DEFAULT_SD_CACHE_SIZE = 128
+# Text embeddings of recent prompts and negative prompts kept by the local pipeline
+SD_PROMPT_EMBEDDING_CACHE_SIZE = 32
+# Remote SD backend client, seconds
+DEFAULT_SD_REMOTE_TIMEOUT = 30
+DEFAULT_SD_REMOTE_CACHE_TTL = 30
+DEFAULT_SD_REMOTE_CONCURRENCY = 4
+
 PROMPT_PREFIX = "best quality, absurdres, "
 NEGATIVE_PROMPT = """lowres, bad anatomy, error body, error hair, error arm,
 error hands, bad hands, error fingers, bad fingers, missing fingers
@@ -109,3 +166,14 @@ INDICATOR_LIST = [
     "hoodie",
     "sweatshirt",
 ]
+# Inputs of the startup self-check of --quantize
+QUANTIZE_CHECK_SAMPLES = [
+    "I can't believe you remembered my birthday, this is the best day ever!",
+    "Get away from me. I never want to see your face again.",
+    "The storm knocked out the power, and every noise in the old house made me jump.",
+    "She stared at the empty chair where he used to sit and said nothing for hours.",
+    "Wait, the treasure was hidden under the lighthouse the whole time?",
+    "We walked along the river, talked about the trip to the mountains next week, "
+    "and agreed to leave early on Saturday to avoid the traffic.",
+]
+QUANTIZE_CHECK_MAX_TOKENS = 48
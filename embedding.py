@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+_worker_model = None
+_worker_batch_size = None
+
+
+def _init_worker(model_name: str, batch_size: int, threads: int):
+    global _worker_model, _worker_batch_size
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+    _worker_batch_size = batch_size
+
+
+def _encode(texts: list) -> list:
+    return _worker_model.encode(
+        texts, batch_size=_worker_batch_size, show_progress_bar=False
+    ).tolist()
+
+
+def _ping():
+    return True
+
+
+class EmbeddingWorkers:
+    """
+    CPU worker processes for bulk imports, each with its own copy of the
+    embedding model.
+
+    Worker processes are forked for the same reason as in transcription.py,
+    so they are only available on platforms with fork, and must be created
+    before the server starts any thread or loads the model in the parent.
+    That includes the threads of another process pool, such as a
+    ParallelTranscriber, so the two can't be used together.
+    """
+
+    def __init__(self, model_name: str, batch_size: int, processes: int):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(
+                model_name,
+                batch_size,
+                max(1, (os.cpu_count() or 1) // processes),
+            ),
+        )
+        # Forks every worker now, they load their models in the background
+        self.executor.submit(_ping)
+
+    @staticmethod
+    def is_supported() -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    def wait_for_ready(self):
+        self.executor.submit(_ping).result()
+
+    def map(self, chunks: list):
+        return self.executor.map(_encode, chunks)
+
+
+class EmbeddingEngine:
+    """
+    SentenceTransformer wrapper with a configurable batch size and optional
+    CPU worker processes for bulk imports. Calling it embeds a list of texts,
+    so it can be passed to ChromaDB as an embedding function.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int = 32,
+        workers: EmbeddingWorkers = None,
+        device: str = None,
+    ):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def __call__(self, texts: list) -> list:
+        if self.workers is None or len(texts) < self.batch_size * 2:
+            # encode() sorts its input by length before batching
+            return self.model.encode(
+                texts, batch_size=self.batch_size, show_progress_bar=False
+            ).tolist()
+
+        # Bulk imports are sorted by length and split into chunks of whole
+        # batches for the workers, then put back in the input order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        chunk_size = max(
+            self.batch_size,
+            -(-len(texts) // (self.workers.processes * self.batch_size))
+            * self.batch_size,
+        )
+        chunks = [order[i : i + chunk_size] for i in range(0, len(order), chunk_size)]
+        results = [None] * len(texts)
+        outputs = self.workers.map([[texts[i] for i in c] for c in chunks])
+        for chunk, vectors in zip(chunks, outputs):
+            for i, vector in zip(chunk, vectors):
+                results[i] = vector
+        return results
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, features
+
+# Encoders by format name, with their MIME type
+IMAGE_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+IMAGE_FORMAT_ALIASES = {"jpg": "jpeg"}
+
+
+def normalize_image_format(name: str) -> str:
+    """Returns the format name, or None if it's unknown or not available."""
+    name = IMAGE_FORMAT_ALIASES.get(name.lower(), name.lower())
+    if name not in IMAGE_FORMATS:
+        return None
+    if name == "webp" and not features.check("webp"):
+        return None
+    return name
+
+
+def image_mimetype(format: str) -> str:
+    return IMAGE_FORMATS[format][1]
+
+
+def encode_image(
+    image: Image, format: str = "jpeg", quality: int = 75, max_size: int = None
+) -> bytes:
+    """
+    Encodes the image, downscaled first so that its longest side is at most
+    `max_size` pixels. `quality` is ignored by PNG.
+    """
+    if max_size and max(image.size) > max_size:
+        image = image.copy()
+        image.thumbnail((max_size, max_size))
+    encoder, _ = IMAGE_FORMATS[format]
+    if encoder == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffered = BytesIO()
+    if encoder == "PNG":
+        image.save(buffered, format=encoder)
+    else:
+        image.save(buffered, format=encoder, quality=quality)
+    return buffered.getvalue()
+
+
+class ImageEncoder:
+    """
+    Encodes images on a thread pool, off the request threads, single images
+    included. Pillow releases the GIL while it encodes, so the images of a
+    batch are encoded in parallel.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-encoder"
+        )
+
+    def encode_many(self, images: list, **options) -> list:
+        return list(
+            self._executor.map(lambda image: encode_image(image, **options), images)
+        )
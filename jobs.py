@@ -0,0 +1,171 @@
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, data: dict, priority: int = 0):
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.priority = priority
+        self.state = "queued"
+        self.step = 0
+        self.steps = None
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+
+    def set_progress(self, step: int, steps: int):
+        self.step = step
+        self.steps = steps
+        self.progress = min(1.0, step / steps) if steps else 0.0
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "progress": self.progress,
+            "step": self.step,
+            "steps": self.steps,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Bounded priority queue of jobs run one at a time by a worker thread,
+    higher priority first and in submission order within a priority.
+    `run(job)` returns the result of a job, reports progress with
+    job.set_progress and stops early with JobCancelled when
+    job.is_cancelled() becomes true. The last `history` finished jobs are
+    kept for polling.
+    """
+
+    def __init__(self, run, max_size: int = 16, history: int = 32, name="jobs"):
+        self.run = run
+        self.max_size = max_size
+        self.history = history
+        # Cancelled jobs stay in the queue until the worker skips them, so
+        # the limit counts the jobs that are still queued instead
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._jobs = OrderedDict()
+        self._finished = []
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._worker = threading.Thread(target=self._work, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, data: dict, priority: int = 0) -> Job:
+        """Queues a job. Raises queue.Full if the queue is at its limit."""
+        job = Job(data, priority)
+        with self._lock:
+            queued = sum(1 for other in self._jobs.values() if other.state == "queued")
+            if queued >= self.max_size:
+                raise queue.Full()
+            self._jobs[job.id] = job
+            self._queue.put_nowait((-priority, next(self._order), job))
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job._cancelled.set()
+        # Queued jobs are skipped by the worker, running jobs stop at their
+        # next progress check
+        if job.state == "queued":
+            self._finish(job, "cancelled")
+        return True
+
+    def position(self, job: Job) -> int:
+        """Number of queued jobs that run before this one."""
+        with self._queue.mutex:
+            entries = [entry for entry in self._queue.queue if not entry[2].done]
+        key = next((entry[:2] for entry in entries if entry[2] is job), None)
+        if key is None:
+            return 0
+        return sum(1 for entry in entries if entry[:2] < key)
+
+    def _finish(self, job: Job, state: str, result=None, error: str = None):
+        with self._lock:
+            if job.done:
+                return
+            job.state = state
+            job.result = result
+            job.error = error
+            job.finished = time.time()
+            job._done.set()
+            if state == "done":
+                self.completed += 1
+            elif state == "failed":
+                self.failed += 1
+            else:
+                self.cancelled += 1
+            self._finished.append(job.id)
+            while len(self._finished) > self.history:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job.done:
+                continue
+            job.state = "running"
+            job.started = time.time()
+            try:
+                result = self.run(job)
+            except JobCancelled:
+                self._finish(job, "cancelled")
+            except Exception as e:
+                print(f"Job {job.id} failed: {e}")
+                self._finish(job, "failed", error=str(e))
+            else:
+                if job.is_cancelled():
+                    self._finish(job, "cancelled")
+                else:
+                    self._finish(job, "done", result=result)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            "queued": states.count("queued"),
+            "running": states.count("running"),
+            "max_size": self.max_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
@@ -0,0 +1,256 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+
+class ModelEntry:
+    def __init__(
+        self, name: str, load, unload, evictable: bool = True, exclusive: bool = True
+    ):
+        self.name = name
+        self.load = load
+        self.unload = unload
+        self.evictable = evictable
+        self.exclusive = exclusive
+        self.lock = threading.RLock()
+        self.state = "unloaded"
+        self.in_use = 0
+        self.last_used = None
+        self.memory = None
+        self.load_seconds = None
+        self.error = None
+        self.loads = 0
+        self.evictions = 0
+
+
+class ModelRegistry:
+    """
+    Loads a module's models on first use and evicts them when they stay idle
+    longer than `idle_ttl` seconds, or when the resident models exceed
+    `memory_budget` bytes, least recently used first.
+
+    A load function returns the estimated memory of what it loaded in bytes
+    (or None if unknown). An unload function drops every reference to it.
+
+    Exclusive load functions never run at the same time as each other:
+    building a torch model with transformers or diffusers changes process-wide
+    state (the default dtype, weight initialization), so only loads that don't
+    build torch models overlap with them, at startup and on first use alike.
+    """
+
+    def __init__(self, idle_ttl: float = None, memory_budget: int = None):
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self._entries = {}
+        self._exclusive_lock = threading.Lock()
+        self._sweeper = None
+        self._preload_futures = {}
+        self._preload_workers = 0
+        self._preload_started = None
+        self._preload_finished = None
+
+    def register(
+        self, name: str, load, unload, evictable: bool = True, exclusive: bool = True
+    ):
+        self._entries[name] = ModelEntry(name, load, unload, evictable, exclusive)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def load(self, name: str):
+        entry = self._entries[name]
+        with entry.lock:
+            if entry.state == "resident":
+                return
+            entry.state = "loading"
+            entry.error = None
+            started = time.monotonic()
+            try:
+                if entry.exclusive:
+                    with self._exclusive_lock:
+                        entry.memory = entry.load()
+                else:
+                    entry.memory = entry.load()
+            except Exception as e:
+                entry.state = "failed"
+                entry.error = str(e)
+                raise
+            entry.load_seconds = time.monotonic() - started
+            entry.last_used = time.monotonic()
+            entry.loads += 1
+            entry.state = "resident"
+        self.enforce_budget(exclude=name)
+
+    def acquire(self, name: str):
+        entry = self._entries[name]
+        with entry.lock:
+            if entry.state != "resident":
+                self.load(name)
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+
+    def release(self, name: str):
+        entry = self._entries[name]
+        with entry.lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+
+    @contextmanager
+    def use(self, name: str):
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def evict(self, name: str) -> bool:
+        entry = self._entries[name]
+        # Never wait for a model that is being loaded or used
+        if not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            if entry.state != "resident" or entry.in_use > 0 or not entry.evictable:
+                return False
+            print(f"Evicting {name} models")
+            entry.unload()
+            entry.state = "unloaded"
+            entry.memory = None
+            entry.evictions += 1
+            return True
+        finally:
+            entry.lock.release()
+
+    def evict_idle(self):
+        if self.idle_ttl is None:
+            return
+        now = time.monotonic()
+        for entry in list(self._entries.values()):
+            if (
+                entry.state == "resident"
+                and entry.in_use == 0
+                and now - entry.last_used > self.idle_ttl
+            ):
+                self.evict(entry.name)
+
+    def resident_memory(self) -> int:
+        return sum(
+            entry.memory or 0
+            for entry in self._entries.values()
+            if entry.state == "resident"
+        )
+
+    def enforce_budget(self, exclude: str = None):
+        if self.memory_budget is None:
+            return
+        candidates = sorted(
+            (
+                entry
+                for entry in self._entries.values()
+                if entry.state == "resident" and entry.name != exclude
+            ),
+            key=lambda entry: entry.last_used,
+        )
+        for entry in candidates:
+            if self.resident_memory() <= self.memory_budget:
+                break
+            self.evict(entry.name)
+
+    def preload(self, names: list, max_workers: int):
+        """
+        Loads the models of independent modules concurrently. Returns as soon
+        as the loads are submitted, see `wait_for_preload`.
+        """
+        self._preload_workers = max(1, max_workers)
+        self._preload_started = time.monotonic()
+        executor = ThreadPoolExecutor(
+            max_workers=self._preload_workers, thread_name_prefix="model-loader"
+        )
+        self._preload_futures = {
+            name: executor.submit(self._preload_one, name) for name in names
+        }
+        executor.shutdown(wait=False)
+        threading.Thread(
+            target=self._report_preload, name="model-loader-report", daemon=True
+        ).start()
+
+    def _preload_one(self, name: str):
+        try:
+            self.load(name)
+        except Exception as e:
+            print(f"Could not load {name}: {e}")
+
+    def wait_for_preload(self):
+        wait(self._preload_futures.values())
+
+    def _report_preload(self):
+        self.wait_for_preload()
+        self._preload_finished = time.monotonic()
+        print("Startup timings:")
+        for name in self._preload_futures:
+            entry = self._entries[name]
+            timing = (
+                f"{entry.load_seconds:.2f}s"
+                if entry.load_seconds is not None
+                else entry.state
+            )
+            print(f"  {name}: {timing}")
+        print(f"  total: {self._preload_finished - self._preload_started:.2f}s")
+
+    def get_startup_status(self) -> dict:
+        elapsed = None
+        if self._preload_started is not None:
+            finished = self._preload_finished or time.monotonic()
+            elapsed = finished - self._preload_started
+        return {
+            "complete": all(f.done() for f in self._preload_futures.values()),
+            "elapsed_seconds": elapsed,
+            "workers": self._preload_workers,
+            "modules": {
+                name: {
+                    "state": self._entries[name].state,
+                    "load_seconds": self._entries[name].load_seconds,
+                    "error": self._entries[name].error,
+                }
+                for name in self._preload_futures
+            },
+        }
+
+    def start_sweeper(self, interval: float):
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                    self.enforce_budget()
+                except Exception as e:
+                    print("Could not evict idle models:", e)
+
+        self._sweeper = threading.Thread(
+            target=sweep, name="model-sweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def resident(self) -> list:
+        return [
+            name for name, entry in self._entries.items() if entry.state == "resident"
+        ]
+
+    def get_status(self) -> dict:
+        now = time.monotonic()
+        return {
+            name: {
+                "state": entry.state,
+                "in_use": entry.in_use,
+                "evictable": entry.evictable,
+                "idle_seconds": now - entry.last_used
+                if entry.last_used is not None
+                else None,
+                "memory": entry.memory,
+                "load_seconds": entry.load_seconds,
+                "loads": entry.loads,
+                "evictions": entry.evictions,
+                "error": entry.error,
+            }
+            for name, entry in self._entries.items()
+        }
@@ -0,0 +1,89 @@
+import difflib
+import time
+
+import torch
+
+
+def quantize_model(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Returns a copy of the model with dynamic int8 quantization of its linear
+    layers: weights are stored as int8 and activations are quantized on the
+    fly, which speeds up transformer inference on the CPU.
+    """
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def label_agreement(expected: list, actual: list) -> float:
+    """Share of inputs with the same top label, for text classification."""
+    matches = sum(e[0]["label"] == a[0]["label"] for e, a in zip(expected, actual))
+    return matches / len(expected)
+
+
+def set_agreement(expected: list, actual: list) -> float:
+    """Mean Jaccard similarity of the extracted sets, for keyphrases."""
+    scores = []
+    for e, a in zip(expected, actual):
+        e, a = set(e), set(a)
+        scores.append(len(e & a) / len(e | a) if e | a else 1.0)
+    return sum(scores) / len(scores)
+
+
+def text_agreement(expected: list, actual: list) -> float:
+    """Mean character similarity of the generated texts, for summaries."""
+    return sum(
+        difflib.SequenceMatcher(None, e, a).ratio() for e, a in zip(expected, actual)
+    ) / len(expected)
+
+
+def quantized_weight_bytes(model: torch.nn.Module) -> int:
+    """Size of the int8 weights, which are not part of model.parameters()."""
+    total = 0
+    for module in model.modules():
+        if hasattr(module, "_packed_params") and callable(
+            getattr(module, "weight", None)
+        ):
+            weight = module.weight()
+            total += weight.numel() * weight.element_size()
+    return total
+
+
+def _timed(run, model: torch.nn.Module, samples: list):
+    # The first call pays for lazy initialization, so it is not timed
+    run(model, samples[:1])
+    started = time.perf_counter()
+    outputs = run(model, samples)
+    return outputs, time.perf_counter() - started
+
+
+def self_check(
+    name: str,
+    run,
+    samples: list,
+    float_model: torch.nn.Module,
+    quantized_model: torch.nn.Module,
+    agreement,
+) -> dict:
+    """
+    Runs the samples through the float and the quantized model with
+    `run(model, samples)`, and reports the speedup and how well the
+    quantized outputs agree with the float ones (1.0 is identical).
+    """
+    with torch.inference_mode():
+        float_outputs, float_seconds = _timed(run, float_model, samples)
+        quantized_outputs, quantized_seconds = _timed(run, quantized_model, samples)
+
+    report = {
+        "float_ms": float_seconds * 1000,
+        "quantized_ms": quantized_seconds * 1000,
+        "speedup": float_seconds / max(quantized_seconds, 1e-9),
+        "agreement": agreement(float_outputs, quantized_outputs),
+        "samples": len(samples),
+    }
+    print(
+        f"Quantized {name}: {report['float_ms']:.0f}ms -> "
+        f"{report['quantized_ms']:.0f}ms ({report['speedup']:.2f}x),",
+        f"{report['agreement']:.0%} agreement with the float model",
+    )
+    return report
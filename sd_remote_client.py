@@ -0,0 +1,144 @@
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+
+
+class RemoteSDClient:
+    """
+    Wraps a webuiapi.WebUIApi with a pooled keep-alive HTTP session, request
+    timeouts, a limit on concurrent requests to the backend, and a short-TTL
+    cache of the model and sampler lists and the current model, which the
+    UI polls constantly.
+
+    Generation requests use `generation_timeout`, every other request uses
+    `timeout`. Progress and interrupt requests bypass the concurrency limit,
+    so they are never stuck behind a running generation.
+    """
+
+    def __init__(
+        self,
+        api,
+        timeout: float = 30,
+        generation_timeout: float = None,
+        connect_timeout: float = 5,
+        max_concurrency: int = 4,
+        cache_ttl: float = 30,
+    ):
+        self.api = api
+        self.timeout = timeout
+        self.generation_timeout = generation_timeout
+        self.connect_timeout = connect_timeout
+        self.max_concurrency = max_concurrency
+        self.cache_ttl = cache_ttl
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._local = threading.local()
+        self._cache = {}
+        self._cache_locks = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Progress polls and interrupts come on top of the limited requests
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency + 2)
+        session = api.session
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        send = session.request
+
+        def request(method, url, **kwargs):
+            kwargs.setdefault("timeout", self._get_timeout())
+            with self._lock:
+                self.requests += 1
+            return send(method, url, **kwargs)
+
+        session.request = request
+
+    def _get_timeout(self):
+        generation = getattr(self._local, "generation", False)
+        read_timeout = self.generation_timeout if generation else self.timeout
+        return (self.connect_timeout, read_timeout)
+
+    def _call(self, fn, *args, generation=False, limited=True, **kwargs):
+        self._local.generation = generation
+        try:
+            if not limited:
+                return fn(*args, **kwargs)
+            with self._semaphore:
+                return fn(*args, **kwargs)
+        finally:
+            self._local.generation = False
+
+    def _cached(self, key: str, fn):
+        if self.cache_ttl <= 0:
+            return self._call(fn)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            key_lock = self._cache_locks.setdefault(key, threading.Lock())
+
+        # Concurrent misses wait for a single request to the backend
+        with key_lock:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+            value = self._call(fn)
+            with self._lock:
+                self._cache[key] = (time.monotonic() + self.cache_ttl, value)
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    def set_auth(self, username: str, password: str):
+        self.api.set_auth(username, password)
+
+    def util_wait_for_ready(self):
+        return self._call(self.api.util_wait_for_ready, limited=False)
+
+    def util_get_model_names(self) -> list:
+        return self._cached("models", self.api.util_get_model_names)
+
+    def get_samplers(self) -> list:
+        return self._cached("samplers", self.api.get_samplers)
+
+    def util_get_current_model(self) -> str:
+        return self._cached("current_model", self.api.util_get_current_model)
+
+    def util_set_model(self, name: str, find_closest: bool = True):
+        try:
+            return self._call(
+                self.api.util_set_model,
+                name,
+                find_closest=find_closest,
+                generation=True,
+            )
+        finally:
+            self.invalidate()
+
+    def txt2img(self, **kwargs):
+        return self._call(self.api.txt2img, generation=True, **kwargs)
+
+    def get_progress(self) -> dict:
+        return self._call(self.api.get_progress, limited=False)
+
+    def interrupt(self):
+        return self._call(self.api.interrupt, limited=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_ttl": self.cache_ttl,
+                "max_concurrency": self.max_concurrency,
+            }
@@ -1,4 +1,6 @@
-from functools import wraps
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, wraps
 from flask import (
     Flask,
     jsonify,
@@ -7,6 +9,9 @@ from flask import (
     abort,
     send_from_directory,
     send_file,
+    make_response,
+    Response,
+    stream_with_context,
 )
 from flask_cors import CORS
 import markdown
@@ -14,18 +19,54 @@ import argparse
 from transformers import AutoTokenizer, AutoProcessor, pipeline
 from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM
 from transformers import BlipForConditionalGeneration, GPT2Tokenizer
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 import unicodedata
+import re
 import torch
 import time
 import os
 import gc
+import atexit
+import importlib.metadata
+import inspect
+import itertools
+import queue
+import struct
+import threading
+import wave
+import shutil
+import tempfile
 from PIL import Image
+import numpy as np
 import base64
 from io import BytesIO
 from random import randint
 import webuiapi
 import hashlib
+from batching import MicroBatcher, run_length_sorted
+from cache import DiskCache, ResultCache, cache_key
 from constants import *
+from embedding import EmbeddingEngine, EmbeddingWorkers
+from image_encoding import (
+    IMAGE_FORMATS,
+    ImageEncoder,
+    encode_image,
+    image_mimetype,
+    normalize_image_format,
+)
+from jobs import Job, JobCancelled, JobQueue
+from model_registry import ModelRegistry
+from quantization import (
+    label_agreement,
+    quantize_model,
+    quantized_weight_bytes,
+    self_check,
+    set_agreement,
+    text_agreement,
+)
+from sd_remote_client import RemoteSDClient
+from transcription import SAMPLE_RATE, ParallelTranscriber, transcription_info
+from vectorstore import ChromaVectorStore, NumpyVectorStore, mmr_rerank
 from colorama import Fore, Style, init as colorama_init
 
 colorama_init()
@@ -52,6 +93,11 @@ parser.add_argument(
     "--share", action="store_true", help="Share the app on CloudFlare tunnel"
 )
 parser.add_argument("--cpu", action="store_true", help="Run the models on the CPU")
+parser.add_argument(
+    "--quantize",
+    action="store_true",
+    help="Quantize the classify, keywords and summarize models to int8 on the CPU",
+)
 parser.add_argument("--summarization-model", help="Load a custom summarization model")
 parser.add_argument(
     "--classification-model", help="Load a custom text classification model"
@@ -62,6 +108,154 @@ parser.add_argument(
 )
 parser.add_argument("--prompt-model", help="Load a custom prompt generation model")
 parser.add_argument("--embedding-model", help="Load a custom text embedding model")
+parser.add_argument(
+    "--max-batch-size",
+    type=int,
+    help="Maximum number of concurrent requests merged into one model batch",
+)
+parser.add_argument(
+    "--batch-window",
+    type=float,
+    help="Time in milliseconds to wait for more requests before running a batch",
+)
+parser.add_argument(
+    "--cache-size",
+    type=int,
+    help="Memory limit of the result cache in megabytes (0 to disable)",
+)
+parser.add_argument(
+    "--cache-ttl", type=float, help="Expire cached results after this many seconds"
+)
+parser.add_argument("--cache-dir", help="Keep an on-disk tier of the result cache")
+parser.add_argument(
+    "--cache-disk-size",
+    type=int,
+    help="Size limit of the on-disk result cache in megabytes",
+)
+parser.add_argument(
+    "--lazy-load",
+    action="store_true",
+    help="Load the models of each module on first use instead of at startup",
+)
+parser.add_argument(
+    "--model-idle-ttl",
+    type=float,
+    help="Unload the models of a module after this many seconds without use",
+)
+parser.add_argument(
+    "--model-memory-budget",
+    type=int,
+    help="Unload the least recently used models when loaded models exceed this many megabytes",
+)
+parser.add_argument(
+    "--startup-workers",
+    type=int,
+    help="Number of modules loaded concurrently at startup",
+)
+parser.add_argument(
+    "--serve-while-loading",
+    action="store_true",
+    help="Start serving requests before all modules are loaded",
+)
+parser.add_argument(
+    "--transcribe-model", help="Load a custom faster-whisper model or model size"
+)
+parser.add_argument(
+    "--transcribe-device",
+    choices=["cpu", "cuda"],
+    default="cpu",
+    help="Run the transcription model on this device",
+)
+parser.add_argument(
+    "--transcribe-compute-type",
+    help="Compute type of the transcription model (e.g. int8, int8_float16, float16)",
+)
+parser.add_argument(
+    "--transcribe-threads",
+    type=int,
+    help="Number of CPU threads used by the transcription model",
+)
+parser.add_argument(
+    "--transcribe-beam-size", type=int, help="Beam size used for transcription"
+)
+parser.add_argument(
+    "--transcribe-workers",
+    type=int,
+    help="Transcribe long audio in parallel across this many worker processes",
+)
+parser.add_argument(
+    "--transcribe-window",
+    type=float,
+    help="Length in seconds of the windows long audio is split into",
+)
+parser.add_argument(
+    "--transcribe-vad",
+    action="store_true",
+    help="Skip the silent parts of the audio with a voice activity detector",
+)
+parser.add_argument(
+    "--tts-cache-dir", help="Directory of the generated TTS audio cache"
+)
+parser.add_argument(
+    "--tts-cache-size",
+    type=int,
+    help="Size limit of the generated TTS audio cache in megabytes (0 to disable)",
+)
+parser.add_argument(
+    "--embedding-batch-size",
+    type=int,
+    help="Number of texts embedded per batch by the chromadb module",
+)
+parser.add_argument(
+    "--embedding-processes",
+    type=int,
+    help="Embed large chromadb imports across this many CPU worker processes",
+)
+parser.add_argument(
+    "--vector-store",
+    choices=["chromadb", "numpy"],
+    default="chromadb",
+    help="Backend of the chromadb module",
+)
+parser.add_argument(
+    "--chroma-persist",
+    action="store_true",
+    help="Keep ChromaDB collections on disk so they survive restarts",
+)
+parser.add_argument(
+    "--chroma-folder", help="Directory of the persistent ChromaDB or NumPy vector store"
+)
+parser.add_argument(
+    "--chroma-idle-ttl",
+    type=float,
+    help="Page chat collections out to disk after this many seconds without use",
+)
+parser.add_argument(
+    "--chroma-memory-budget",
+    type=int,
+    help="Page the least recently used chat collections out above this many megabytes",
+)
+parser.add_argument(
+    "--chroma-flush-interval",
+    type=float,
+    help="Write changed ChromaDB collections to disk every this many seconds",
+)
+parser.add_argument(
+    "--sd-queue-size",
+    type=int,
+    help="Maximum number of queued SD image jobs",
+)
+parser.add_argument(
+    "--sd-cache-size",
+    type=int,
+    help="Memory limit of the cache of seeded local SD images in megabytes "
+    "(0 to disable)",
+)
+parser.add_argument(
+    "--sd-debug-image",
+    action="store_true",
+    help="Save every generated SD image to debug.png",
+)
 
 sd_group = parser.add_mutually_exclusive_group()
 
@@ -87,6 +281,21 @@ remote_sd.add_argument(
     type=str,
     help="Specify the username:password for the remote SD backend (if required)",
 )
+remote_sd.add_argument(
+    "--sd-remote-timeout",
+    type=float,
+    help="Timeout in seconds of the remote SD backend requests, except generation",
+)
+remote_sd.add_argument(
+    "--sd-remote-concurrency",
+    type=int,
+    help="Maximum number of concurrent requests to the remote SD backend",
+)
+remote_sd.add_argument(
+    "--sd-remote-cache-ttl",
+    type=float,
+    help="Cache the remote SD model and sampler lists for this many seconds",
+)
 
 parser.add_argument(
     "--enable-modules",
@@ -97,6 +306,14 @@ parser.add_argument(
 
 args = parser.parse_args()
 
+if (
+    args.transcribe_window is not None
+    and args.transcribe_window < MIN_TRANSCRIBE_WINDOW
+):
+    parser.error(
+        f"--transcribe-window must be at least {MIN_TRANSCRIBE_WINDOW} seconds"
+    )
+
 port = args.port if args.port else 5100
 host = "0.0.0.0" if args.listen else "localhost"
 summarization_model = (
@@ -119,6 +336,22 @@ prompt_model = args.prompt_model if args.prompt_model else DEFAULT_PROMPT_MODEL
 embedding_model = (
     args.embedding_model if args.embedding_model else DEFAULT_EMBEDDING_MODEL
 )
+embedding_batch_size = (
+    args.embedding_batch_size
+    if args.embedding_batch_size
+    else DEFAULT_EMBEDDING_BATCH_SIZE
+)
+max_batch_size = args.max_batch_size if args.max_batch_size else DEFAULT_MAX_BATCH_SIZE
+batch_window = (
+    args.batch_window if args.batch_window is not None else DEFAULT_BATCH_WINDOW
+)
+cache_size = args.cache_size if args.cache_size is not None else DEFAULT_CACHE_SIZE
+sd_cache_size = (
+    args.sd_cache_size if args.sd_cache_size is not None else DEFAULT_SD_CACHE_SIZE
+)
+cache_disk_size = (
+    args.cache_disk_size if args.cache_disk_size else DEFAULT_CACHE_DISK_SIZE
+)
 
 sd_use_remote = False if args.sd_model else True
 sd_model = args.sd_model if args.sd_model else DEFAULT_SD_MODEL
@@ -127,8 +360,14 @@ sd_remote_port = args.sd_remote_port if args.sd_remote_port else DEFAULT_REMOTE_
 sd_remote_ssl = args.sd_remote_ssl
 sd_remote_auth = args.sd_remote_auth
 
-# TODO: add option to argparser
-faster_whisper_model = DEFAULT_FASTER_WHISPER_MODEL
+faster_whisper_model = (
+    args.transcribe_model if args.transcribe_model else DEFAULT_FASTER_WHISPER_MODEL
+)
+transcribe_beam_size = (
+    args.transcribe_beam_size
+    if args.transcribe_beam_size
+    else DEFAULT_TRANSCRIBE_BEAM_SIZE
+)
 
 modules = (
     args.enable_modules if args.enable_modules and len(args.enable_modules) > 0 else []
@@ -140,12 +379,140 @@ if len(modules) == 0:
     )
     print(f"Example: --enable-modules=caption,summarize{Style.RESET_ALL}")
 
+# Worker processes are forked before the server starts any thread, see
+# ParallelTranscriber. They are kept for the life of the server, since they
+# could not be forked safely again once the models load concurrently. Only
+# one pool is forked: starting a pool starts its threads.
+parallel_transcriber = embedding_workers = None
+if "transcribe" in modules and args.transcribe_workers:
+    if not ParallelTranscriber.is_supported():
+        print("Parallel transcription needs fork(), which this platform does not have")
+    else:
+        print(f"Starting {args.transcribe_workers} transcription worker processes")
+        parallel_transcriber = ParallelTranscriber(
+            faster_whisper_model,
+            args.transcribe_workers,
+            compute_type=args.transcribe_compute_type
+            if args.transcribe_compute_type and args.transcribe_device == "cpu"
+            else DEFAULT_TRANSCRIBE_COMPUTE_TYPE["cpu"],
+            cpu_threads=args.transcribe_threads
+            if args.transcribe_threads
+            else max(1, os.cpu_count() // args.transcribe_workers),
+            window=args.transcribe_window
+            if args.transcribe_window
+            else DEFAULT_TRANSCRIBE_WINDOW,
+            overlap=DEFAULT_TRANSCRIBE_OVERLAP,
+            options={
+                "beam_size": transcribe_beam_size,
+                "vad_filter": args.transcribe_vad,
+            },
+        )
+if "chromadb" in modules and args.embedding_processes:
+    # The transcription pool already runs its manager and feeder threads,
+    # so another pool could not be forked safely
+    if parallel_transcriber is not None:
+        print(
+            "Embedding worker processes can't be combined with --transcribe-workers,",
+            "embedding in the server process",
+        )
+    elif not EmbeddingWorkers.is_supported():
+        print(
+            "Embedding worker processes need fork(), which this platform does not have"
+        )
+    else:
+        print(f"Starting {args.embedding_processes} embedding worker processes")
+        embedding_workers = EmbeddingWorkers(
+            embedding_model, embedding_batch_size, args.embedding_processes
+        )
+
 # Models init
 device_string = "cuda:0" if torch.cuda.is_available() and not args.cpu else "cpu"
 device = torch.device(device_string)
 torch_dtype = torch.float32 if device_string == "cpu" else torch.float16
 
-if "caption" in modules:
+quantize_cpu = args.quantize and device_string == "cpu"
+if args.quantize and not quantize_cpu:
+    print("Quantization only applies to models on the CPU, add --cpu to use it")
+# Results of the quantized models are cached apart from the float ones
+quantized_suffix = "-int8" if quantize_cpu else ""
+quantization_reports = {}
+
+if args.chroma_folder:
+    chroma_folder = args.chroma_folder
+elif args.vector_store == "numpy":
+    chroma_folder = NUMPY_VECTOR_STORE_PATH
+else:
+    chroma_folder = CHROMA_PERSIST_PATH
+# The NumPy vector store always keeps its chat indexes on disk
+chroma_persist = args.chroma_persist or args.vector_store == "numpy"
+chroma_budget = (
+    args.chroma_memory_budget * 1024 * 1024 if args.chroma_memory_budget else None
+)
+chroma_flush_interval = (
+    args.chroma_flush_interval
+    if args.chroma_flush_interval
+    else DEFAULT_CHROMA_FLUSH_INTERVAL
+)
+
+tts_cache_size = (
+    args.tts_cache_size if args.tts_cache_size is not None else DEFAULT_TTS_CACHE_SIZE
+)
+tts_cache = (
+    DiskCache(
+        args.tts_cache_dir if args.tts_cache_dir else TTS_CACHE_PATH,
+        tts_cache_size * 1024 * 1024,
+        suffix=".wav",
+    )
+    if "tts" in modules and tts_cache_size > 0
+    else None
+)
+
+result_cache = ResultCache(
+    cache_size * 1024 * 1024,
+    ttl=args.cache_ttl,
+    disk=DiskCache(args.cache_dir, cache_disk_size * 1024 * 1024)
+    if args.cache_dir
+    else None,
+)
+
+# Generated images are kept apart from the text results, as PNG bytes
+sd_image_cache = ResultCache(sd_cache_size * 1024 * 1024)
+image_encoder = ImageEncoder(IMAGE_ENCODER_WORKERS)
+
+
+def model_memory(*models) -> int:
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for model in models
+        if isinstance(model, torch.nn.Module)
+        for tensor in itertools.chain(model.parameters(), model.buffers())
+    ) + sum(
+        quantized_weight_bytes(model)
+        for model in models
+        if isinstance(model, torch.nn.Module)
+    )
+
+
+def quantize_and_check(name: str, model, run, agreement):
+    print(f"Quantizing the {name} model")
+    quantized = quantize_model(model)
+    try:
+        quantization_reports[name] = self_check(
+            name, run, QUANTIZE_CHECK_SAMPLES, model, quantized, agreement
+        )
+    except Exception as e:
+        print(f"Could not check the quantized {name} model: {e}")
+    return quantized
+
+
+def free_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def load_caption():
+    global captioning_processor, captioning_transformer
     print("Initializing an image captioning model...")
     captioning_processor = AutoProcessor.from_pretrained(captioning_model)
     if "blip" in captioning_model:
@@ -156,15 +523,54 @@ if "caption" in modules:
         captioning_transformer = AutoModelForCausalLM.from_pretrained(
             captioning_model, torch_dtype=torch_dtype
         ).to(device)
+    return model_memory(captioning_transformer)
 
-if "summarize" in modules:
+
+def unload_caption():
+    global captioning_processor, captioning_transformer
+    captioning_processor = captioning_transformer = None
+    free_memory()
+
+
+def load_summarize():
+    global summarization_tokenizer, summarization_transformer
     print("Initializing a text summarization model...")
     summarization_tokenizer = AutoTokenizer.from_pretrained(summarization_model)
     summarization_transformer = AutoModelForSeq2SeqLM.from_pretrained(
         summarization_model, torch_dtype=torch_dtype
     ).to(device)
+    if quantize_cpu:
+        summarization_transformer = quantize_and_check(
+            "summarize",
+            summarization_transformer,
+            run_summarization_check,
+            text_agreement,
+        )
+    get_bad_words_ids.cache_clear()
+    return model_memory(summarization_transformer)
 
-if "classify" in modules:
+
+def run_summarization_check(model, texts: list) -> list:
+    inputs = summarization_tokenizer(
+        texts, return_tensors="pt", padding=True, truncation=True
+    )
+    summary_ids = model.generate(
+        inputs["input_ids"],
+        attention_mask=inputs["attention_mask"],
+        num_beams=1,
+        max_new_tokens=QUANTIZE_CHECK_MAX_TOKENS,
+    )
+    return summarization_tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+
+def unload_summarize():
+    global summarization_tokenizer, summarization_transformer
+    summarization_tokenizer = summarization_transformer = None
+    free_memory()
+
+
+def load_classify():
+    global classification_pipe, classification_labels
     print("Initializing a sentiment classification pipeline...")
     classification_pipe = pipeline(
         "text-classification",
@@ -173,14 +579,51 @@ if "classify" in modules:
         device=device,
         torch_dtype=torch_dtype,
     )
+    if quantize_cpu:
+
+        def run(model, texts: list) -> list:
+            classification_pipe.model = model
+            return classification_pipe(texts)
+
+        classification_pipe.model = quantize_and_check(
+            "classify", classification_pipe.model, run, label_agreement
+        )
+    classification_labels = list(classification_pipe.model.config.id2label.values())
+    return model_memory(classification_pipe.model)
+
+
+def unload_classify():
+    global classification_pipe
+    classification_pipe = None
+    free_memory()
+
 
-if "keywords" in modules:
+def load_keywords():
+    global keyphrase_pipe
     print("Initializing a keyword extraction pipeline...")
     import pipelines as pipelines
 
     keyphrase_pipe = pipelines.KeyphraseExtractionPipeline(keyphrase_model)
+    if quantize_cpu:
+
+        def run(model, texts: list) -> list:
+            keyphrase_pipe.model = model
+            return keyphrase_pipe(texts)
+
+        keyphrase_pipe.model = quantize_and_check(
+            "keywords", keyphrase_pipe.model, run, set_agreement
+        )
+    return model_memory(keyphrase_pipe.model)
+
 
-if "prompt" in modules:
+def unload_keywords():
+    global keyphrase_pipe
+    keyphrase_pipe = None
+    free_memory()
+
+
+def load_prompt():
+    global gpt_tokenizer, gpt_model, prompt_generator
     print("Initializing a prompt generator")
     gpt_tokenizer = GPT2Tokenizer.from_pretrained("distilgpt2")
     gpt_tokenizer.add_special_tokens({"pad_token": "[PAD]"})
@@ -188,31 +631,150 @@ if "prompt" in modules:
     prompt_generator = pipeline(
         "text-generation", model=gpt_model, tokenizer=gpt_tokenizer
     )
+    return model_memory(gpt_model)
+
+
+def unload_prompt():
+    global gpt_tokenizer, gpt_model, prompt_generator
+    gpt_tokenizer = gpt_model = prompt_generator = None
+    free_memory()
+
+
+def memoize_prompt_embeddings(pipe, max_entries: int):
+    """
+    Keeps the text embeddings of the last prompts the pipeline encoded. The
+    prompt and the negative prompt are encoded as separate CLIP sequences,
+    so they are cached on their own: the constant negative prompt is encoded
+    once and reused with every new prompt. The prompt prefix is part of the
+    prompt's sequence, and CLIP embeddings are contextual, so it can't be.
+
+    A pair padded to different lengths when encoded apart (prompts longer
+    than one CLIP window) is encoded and cached together.
+    """
+    encode_prompt = getattr(pipe, "_encode_prompt", None)
+    if encode_prompt is None:
+        print("The SD pipeline has no _encode_prompt, embeddings are not cached")
+        return
+    signature = inspect.signature(encode_prompt)
+    split_arguments = (
+        "prompt",
+        "negative_prompt",
+        "num_images_per_prompt",
+        "do_classifier_free_guidance",
+    )
+    if not all(name in signature.parameters for name in split_arguments):
+        print("The SD pipeline encodes prompts differently, only pairs are cached")
+        split_arguments = None
+    embeddings = OrderedDict()
+    lock = threading.Lock()
+
+    def cached(key: str, compute):
+        with lock:
+            if key in embeddings:
+                embeddings.move_to_end(key)
+                return embeddings[key]
+        value = compute()
+        with lock:
+            embeddings[key] = value
+            while len(embeddings) > max_entries:
+                embeddings.popitem(last=False)
+        return value
+
+    def encode_alone(arguments: dict, prompt: str):
+        arguments = {
+            **arguments,
+            "prompt": prompt,
+            "negative_prompt": None,
+            "num_images_per_prompt": 1,
+            "do_classifier_free_guidance": False,
+        }
+        options = sorted(
+            (name, value)
+            for name, value in arguments.items()
+            if name not in split_arguments
+        )
+        return cached(
+            cache_key("alone", prompt, *options),
+            lambda: encode_prompt(**arguments),
+        )
+
+    @wraps(encode_prompt)
+    def cached_encode_prompt(*args, **kwargs):
+        def encode_pair():
+            return cached(
+                cache_key("pair", *args, *sorted(kwargs.items())),
+                lambda: encode_prompt(*args, **kwargs),
+            )
+
+        if split_arguments is None:
+            return encode_pair()
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        if not (
+            arguments["do_classifier_free_guidance"]
+            and isinstance(arguments["prompt"], str)
+            and isinstance(arguments["negative_prompt"], str)
+        ):
+            return encode_pair()
+
+        text = encode_alone(arguments, arguments["prompt"])
+        uncond = encode_alone(arguments, arguments["negative_prompt"])
+        if text.shape != uncond.shape:
+            return encode_pair()
+        # Same layout as the pipeline: every unconditional embedding, then
+        # every prompt embedding, each repeated for the images of the prompt
+        images = arguments["num_images_per_prompt"]
+        return torch.cat(
+            [
+                uncond.repeat_interleave(images, dim=0),
+                text.repeat_interleave(images, dim=0),
+            ]
+        )
 
-if "sd" in modules and not sd_use_remote:
-    from diffusers import StableDiffusionPipeline
-    from diffusers import EulerAncestralDiscreteScheduler
+    pipe._encode_prompt = cached_encode_prompt
+
+
+def load_sd():
+    global sd_pipe, sd_device, sd_remote
+
+    if not sd_use_remote:
+        from diffusers import StableDiffusionPipeline
+        from diffusers import EulerAncestralDiscreteScheduler
+
+        print("Initializing Stable Diffusion pipeline")
+        sd_device_string = (
+            "cuda" if torch.cuda.is_available() and not args.sd_cpu else "cpu"
+        )
+        sd_device = torch.device(sd_device_string)
+        sd_torch_dtype = torch.float32 if sd_device_string == "cpu" else torch.float16
+        sd_pipe = StableDiffusionPipeline.from_pretrained(
+            sd_model, custom_pipeline="lpw_stable_diffusion", torch_dtype=sd_torch_dtype
+        ).to(sd_device)
+        sd_pipe.safety_checker = lambda images, clip_input: (images, False)
+        sd_pipe.enable_attention_slicing()
+        # pipe.scheduler = KarrasVeScheduler.from_config(pipe.scheduler.config)
+        sd_pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(
+            sd_pipe.scheduler.config
+        )
+        memoize_prompt_embeddings(sd_pipe, SD_PROMPT_EMBEDDING_CACHE_SIZE)
+        return model_memory(sd_pipe.unet, sd_pipe.vae, sd_pipe.text_encoder)
 
-    print("Initializing Stable Diffusion pipeline")
-    sd_device_string = (
-        "cuda" if torch.cuda.is_available() and not args.sd_cpu else "cpu"
-    )
-    sd_device = torch.device(sd_device_string)
-    sd_torch_dtype = torch.float32 if sd_device_string == "cpu" else torch.float16
-    sd_pipe = StableDiffusionPipeline.from_pretrained(
-        sd_model, custom_pipeline="lpw_stable_diffusion", torch_dtype=sd_torch_dtype
-    ).to(sd_device)
-    sd_pipe.safety_checker = lambda images, clip_input: (images, False)
-    sd_pipe.enable_attention_slicing()
-    # pipe.scheduler = KarrasVeScheduler.from_config(pipe.scheduler.config)
-    sd_pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(
-        sd_pipe.scheduler.config
-    )
-elif "sd" in modules and sd_use_remote:
     print("Initializing Stable Diffusion connection")
     try:
-        sd_remote = webuiapi.WebUIApi(
-            host=sd_remote_host, port=sd_remote_port, use_https=sd_remote_ssl
+        sd_remote = RemoteSDClient(
+            webuiapi.WebUIApi(
+                host=sd_remote_host, port=sd_remote_port, use_https=sd_remote_ssl
+            ),
+            timeout=args.sd_remote_timeout
+            if args.sd_remote_timeout
+            else DEFAULT_SD_REMOTE_TIMEOUT,
+            max_concurrency=args.sd_remote_concurrency
+            if args.sd_remote_concurrency
+            else DEFAULT_SD_REMOTE_CONCURRENCY,
+            cache_ttl=args.sd_remote_cache_ttl
+            if args.sd_remote_cache_ttl is not None
+            else DEFAULT_SD_REMOTE_CACHE_TTL,
         )
         if sd_remote_auth:
             username, password = sd_remote_auth.split(":")
@@ -224,8 +786,21 @@ elif "sd" in modules and sd_use_remote:
             f"{Fore.RED}{Style.BRIGHT}Could not connect to remote SD backend at http{'s' if sd_remote_ssl else ''}://{sd_remote_host}:{sd_remote_port}! Disabling SD module...{Style.RESET_ALL}"
         )
         modules.remove("sd")
+        raise
+    return 0
+
+
+def unload_sd():
+    global sd_pipe, sd_remote
+    sd_pipe = sd_remote = None
+    free_memory()
 
-if "tts" in modules:
+
+sd_pipe = sd_remote = None
+
+
+def load_tts():
+    global tts_service, tts_model_id
     if not os.path.exists(SILERO_SAMPLES_PATH):
         os.makedirs(SILERO_SAMPLES_PATH)
     print("Initializing Silero TTS server")
@@ -237,24 +812,188 @@ if "tts" in modules:
         tts_service.update_sample_text(SILERO_SAMPLE_TEXT)
         tts_service.generate_samples()
 
-if "chromadb" in modules:
+    try:
+        tts_model_id = f"silero-{importlib.metadata.version('silero-api-server')}"
+    except importlib.metadata.PackageNotFoundError:
+        tts_model_id = "silero"
+    return model_memory(getattr(tts_service, "model", None))
+
+
+def unload_tts():
+    global tts_service
+    tts_service = None
+    free_memory()
+
+
+def load_chromadb():
+    global vector_store, chromadb_embedder, chromadb_embed_fn, chromadb_client
+    chromadb_embedder = EmbeddingEngine(
+        embedding_model, batch_size=embedding_batch_size, workers=embedding_workers
+    )
+    if embedding_workers is not None:
+        embedding_workers.wait_for_ready()
+    chromadb_embed_fn = chromadb_embedder
+
+    if args.vector_store == "numpy":
+        print("Initializing NumPy vector store")
+        vector_store = NumpyVectorStore(
+            chroma_folder, idle_ttl=args.chroma_idle_ttl, memory_budget=chroma_budget
+        )
+        print(
+            f"NumPy vector store found {vector_store.stored_chats()} chats",
+            f"in {chroma_folder}",
+        )
+        start_chromadb_sweeper()
+        return model_memory(chromadb_embedder.model)
+
     print("Initializing ChromaDB")
     import chromadb
     import posthog
     from chromadb.config import Settings
-    from sentence_transformers import SentenceTransformer
 
     # disable chromadb telemetry
     posthog.capture = lambda *args, **kwargs: None
-    chromadb_client = chromadb.Client(Settings(anonymized_telemetry=False))
-    chromadb_embedder = SentenceTransformer(embedding_model)
-    chromadb_embed_fn = chromadb_embedder.encode
 
-if "transcribe" in modules:
+    if args.chroma_persist:
+        # A persistent client persists itself at exit and is never freed, so
+        # it is reused when the module is loaded again after an eviction.
+        # Another client would overwrite the newer parquet files at exit.
+        if chromadb_client is None:
+            chromadb_client = chromadb.Client(
+                Settings(
+                    anonymized_telemetry=False,
+                    chroma_db_impl="duckdb+parquet",
+                    persist_directory=chroma_folder,
+                )
+            )
+            collections = chromadb_client.list_collections()
+            print(
+                f"ChromaDB restored {len(collections)} collections with",
+                f"{sum(collection.count() for collection in collections)} vectors",
+                f"from {chroma_folder}",
+            )
+        client = chromadb_client
+    else:
+        client = chromadb.Client(Settings(anonymized_telemetry=False))
+
+    # Paged out collections are spilled next to a persistent ChromaDB, or to
+    # a temporary directory that lives as long as the in-memory one
+    spill_path = None
+    if args.chroma_idle_ttl is not None or chroma_budget is not None:
+        if args.chroma_persist:
+            spill_path = os.path.join(chroma_folder, CHROMA_SPILL_FOLDER)
+        else:
+            spill_path = tempfile.mkdtemp(prefix="chromadb-spill-")
+            atexit.register(shutil.rmtree, spill_path, ignore_errors=True)
+
+    vector_store = ChromaVectorStore(
+        client,
+        chromadb_embed_fn,
+        persistent=args.chroma_persist,
+        spill_path=spill_path,
+        idle_ttl=args.chroma_idle_ttl,
+        memory_budget=chroma_budget,
+    )
+    start_chromadb_sweeper()
+    return model_memory(chromadb_embedder.model)
+
+
+def start_chromadb_sweeper():
+    if args.chroma_idle_ttl is not None or chroma_budget is not None:
+        vector_store.start_sweeper(
+            min(args.chroma_idle_ttl / 2, 30)
+            if args.chroma_idle_ttl is not None
+            else 30
+        )
+
+
+def unload_chromadb():
+    global vector_store, chromadb_embedder, chromadb_embed_fn
+    chromadb_dirty.clear()
+    vector_store.close()
+    vector_store = chromadb_embedder = chromadb_embed_fn = None
+    free_memory()
+
+
+vector_store = chromadb_client = None
+chromadb_dirty = threading.Event()
+
+
+def persist_chromadb():
+    store = vector_store
+    if chroma_persist and store is not None and chromadb_dirty.is_set():
+        chromadb_dirty.clear()
+        store.persist()
+        print(f"{store.name} vector store persisted to", chroma_folder)
+
+
+def flush_chromadb():
+    while True:
+        time.sleep(chroma_flush_interval)
+        try:
+            persist_chromadb()
+        except Exception as e:
+            print("Could not persist the vector store:", e)
+
+
+def load_transcribe():
+    global transcribe_model
     print("Initializing faster whisper")
     from faster_whisper import WhisperModel
-    # FIXME: get the device and compute type from arguments
-    transcribe_model = WhisperModel(faster_whisper_model, device="cpu", compute_type="int8")
+
+    transcribe_model = WhisperModel(
+        faster_whisper_model,
+        device=args.transcribe_device,
+        compute_type=args.transcribe_compute_type
+        if args.transcribe_compute_type
+        else DEFAULT_TRANSCRIBE_COMPUTE_TYPE[args.transcribe_device],
+        cpu_threads=args.transcribe_threads if args.transcribe_threads else 0,
+    )
+
+    if parallel_transcriber is not None:
+        parallel_transcriber.wait_for_ready()
+    return None
+
+
+def unload_transcribe():
+    global transcribe_model
+    transcribe_model = None
+    free_memory()
+
+
+model_registry = ModelRegistry(
+    idle_ttl=args.model_idle_ttl,
+    memory_budget=args.model_memory_budget * 1024 * 1024
+    if args.model_memory_budget
+    else None,
+)
+model_loaders = {
+    "caption": (load_caption, unload_caption),
+    "summarize": (load_summarize, unload_summarize),
+    "classify": (load_classify, unload_classify),
+    "keywords": (load_keywords, unload_keywords),
+    "prompt": (load_prompt, unload_prompt),
+    "sd": (load_sd, unload_sd),
+    "tts": (load_tts, unload_tts),
+    "chromadb": (load_chromadb, unload_chromadb),
+    "transcribe": (load_transcribe, unload_transcribe),
+}
+
+for name in modules:
+    if name in model_loaders:
+        load, unload = model_loaders[name]
+        # In-memory chat collections would be lost if ChromaDB was unloaded
+        evictable = name != "chromadb" or chroma_persist
+        # faster-whisper and the remote SD client build no torch models, so
+        # they can load while another module does
+        exclusive = name != "transcribe" and (name != "sd" or not sd_use_remote)
+        model_registry.register(
+            name, load, unload, evictable=evictable, exclusive=exclusive
+        )
+
+if "chromadb" in modules and chroma_persist:
+    threading.Thread(target=flush_chromadb, name="chromadb-flush", daemon=True).start()
+    atexit.register(persist_chromadb)
 
 # Flask init
 app = Flask(__name__)
@@ -268,71 +1007,470 @@ def require_module(name):
         def decorated_view(*args, **kwargs):
             if name not in modules:
                 abort(403, "Module is disabled by config")
-            return fn(*args, **kwargs)
+
+            # Loads the module's models on first use and keeps them
+            # from being evicted until the response is closed
+            try:
+                model_registry.acquire(name)
+            except Exception as e:
+                if name not in modules:
+                    abort(403, "Module is disabled by config")
+                abort(503, f"Module failed to load: {e}")
+
+            try:
+                response = make_response(fn(*args, **kwargs))
+            except BaseException:
+                model_registry.release(name)
+                raise
+
+            response.call_on_close(lambda: model_registry.release(name))
+            return response
 
         return decorated_view
 
     return wrapper
 
 
+def is_text_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(x, str) for x in value)
+
+
+def get_option(name: str):
+    """Reads an option from the query string, form fields or JSON body."""
+    value = request.args.get(name, request.form.get(name))
+    if value is None:
+        data = request.get_json(silent=True)
+        value = data.get(name) if isinstance(data, dict) else None
+    return value
+
+
+def get_int_option(name: str, default: int, minimum: int, maximum: int) -> int:
+    value = get_option(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        abort(400, f'"{name}" must be an integer')
+    if not minimum <= value <= maximum:
+        abort(400, f'"{name}" must be from {minimum} to {maximum}')
+    return value
+
+
+def get_flag(name: str) -> bool:
+    """Reads a boolean option from the query string, form fields or JSON body."""
+    value = get_option(name)
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def sse_event(data, event: str = None) -> str:
+    # Serialized like jsonify, which also handles dataclasses
+    message = f"data: {app.json.dumps(data)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+
+def read_request_stream():
+    # Large bodies are spooled to disk instead of being held in memory
+    upload = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    shutil.copyfileobj(request.stream, upload, UPLOAD_CHUNK_SIZE)
+    upload.seek(0)
+    return upload
+
+
+def get_uploads(field: str) -> list:
+    """
+    Returns seekable binary streams of the files uploaded in `field`.
+    Accepts multipart/form-data, a raw application/octet-stream body
+    or a JSON body with base64 encoded strings.
+    """
+    if request.files:
+        return [file.stream for file in request.files.getlist(field)]
+    if request.mimetype == "application/octet-stream":
+        return [read_request_stream()]
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        abort(400, f'"{field}" is required')
+    value = data.get(field)
+    if isinstance(value, str):
+        return [BytesIO(base64.b64decode(value))]
+    if is_text_list(value):
+        return [BytesIO(base64.b64decode(item)) for item in value]
+    return []
+
+
 # AI stuff
 def classify_text(text: str) -> list:
-    output = classification_pipe(
-        text,
+    return result_cache.get_or_compute(
+        "classify",
+        cache_key(classification_model + quantized_suffix, text),
+        lambda: batchers["classify"](text),
+    )
+
+
+def classify_texts(texts: list) -> list:
+    outputs = classification_pipe(
+        texts,
         truncation=True,
         max_length=classification_pipe.model.config.max_position_embeddings,
-    )[0]
-    return sorted(output, key=lambda x: x["score"], reverse=True)
+        batch_size=len(texts),
+    )
+    return [
+        sorted(output, key=lambda x: x["score"], reverse=True) for output in outputs
+    ]
+
+
+def caption_cache_key(image: Image, max_new_tokens: int) -> str:
+    return cache_key(captioning_model, max_new_tokens, image.size, image.tobytes())
 
 
 def caption_image(raw_image: Image, max_new_tokens: int = 20) -> str:
-    inputs = captioning_processor(raw_image.convert("RGB"), return_tensors="pt").to(
+    raw_image = raw_image.convert("RGB")
+    return result_cache.get_or_compute(
+        "caption",
+        caption_cache_key(raw_image, max_new_tokens),
+        lambda: batchers["caption"]((raw_image, max_new_tokens)),
+    )
+
+
+def caption_images(images: list, max_new_tokens: int = 20) -> list:
+    inputs = captioning_processor(images=images, return_tensors="pt").to(
         device, torch_dtype
     )
     outputs = captioning_transformer.generate(**inputs, max_new_tokens=max_new_tokens)
-    caption = captioning_processor.decode(outputs[0], skip_special_tokens=True)
-    return caption
+    return captioning_processor.batch_decode(outputs, skip_special_tokens=True)
+
+
+def caption_batch(items: list) -> list:
+    # Requests with a different max_new_tokens are generated separately
+    captions = [None] * len(items)
+    groups = {}
+    for i, (_, max_new_tokens) in enumerate(items):
+        groups.setdefault(max_new_tokens, []).append(i)
+    for max_new_tokens, indices in groups.items():
+        outputs = caption_images([items[i][0] for i in indices], max_new_tokens)
+        for i, caption in zip(indices, outputs):
+            captions[i] = caption
+    return captions
+
+
+def get_summarization_max_length() -> int:
+    config_length = getattr(
+        summarization_transformer.config, "max_position_embeddings", None
+    )
+    tokenizer_length = summarization_tokenizer.model_max_length
+    return min(config_length or tokenizer_length, tokenizer_length)
+
+
+@lru_cache(maxsize=16)
+def get_bad_words_ids(bad_words: tuple) -> list:
+    return [
+        summarization_tokenizer(bad_word, add_special_tokens=False).input_ids
+        for bad_word in bad_words
+    ]
+
+
+def split_summary_segments(text: str) -> list:
+    # Split at message (newline) and sentence boundaries, keeping the separators
+    pieces = re.split(r"(\n+|(?<=[.!?])\s+)", text)
+    pieces.append("")
+    return [
+        pieces[i] + pieces[i + 1] for i in range(0, len(pieces) - 1, 2) if pieces[i]
+    ]
+
+
+def plan_summary_chunks(text: str, max_tokens: int) -> list:
+    segments = split_summary_segments(text)
+    if len(segments) == 0:
+        return [text]
+
+    lengths = [
+        len(ids)
+        for ids in summarization_tokenizer(segments, add_special_tokens=False).input_ids
+    ]
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def flush():
+        if current:
+            chunks.append("".join(current).strip())
+            current.clear()
+
+    for segment, length in zip(segments, lengths):
+        if length > max_tokens:
+            # A single sentence that does not fit is cut at token boundaries
+            flush()
+            current_tokens = 0
+            ids = summarization_tokenizer(segment, add_special_tokens=False).input_ids
+            chunks.extend(
+                summarization_tokenizer.decode(ids[i : i + max_tokens]).strip()
+                for i in range(0, len(ids), max_tokens)
+            )
+            continue
+        if current_tokens + length > max_tokens:
+            flush()
+            current_tokens = 0
+        current.append(segment)
+        current_tokens += length
+
+    flush()
+    return chunks
 
 
 def summarize_chunks(text: str, params: dict) -> str:
-    try:
-        return summarize(text, params)
-    except IndexError:
-        print(
-            "Sequence length too large for model, cutting text in half and calling again"
+    max_length = get_summarization_max_length()
+    max_tokens = max_length - summarization_tokenizer.num_special_tokens_to_add()
+    chunks = plan_summary_chunks(text, max_tokens)
+
+    if len(chunks) == 1:
+        return summarize(chunks[0], params)
+
+    print(f"Sequence length too large for model, summarizing {len(chunks)} chunks")
+    chunk_params = params.copy()
+    chunk_params["max_length"] = int(params["max_length"]) // len(chunks)
+    chunk_params["min_length"] = int(params["min_length"]) // len(chunks)
+    summaries = []
+
+    for start in range(0, len(chunks), max_batch_size):
+        summaries.extend(
+            summarize_batch(chunks[start : start + max_batch_size], chunk_params)
         )
-        new_params = params.copy()
-        new_params["max_length"] = new_params["max_length"] // 2
-        new_params["min_length"] = new_params["min_length"] // 2
-        return summarize_chunks(
-            text[: (len(text) // 2)], new_params
-        ) + summarize_chunks(text[(len(text) // 2) :], new_params)
+
+    summary = " ".join(summaries)
+
+    # Optional reduce pass over the partial summaries
+    if params.get("reduce") and len(summary) < len(text):
+        return summarize_chunks(summary, params)
+
+    return summary
 
 
 def summarize(text: str, params: dict) -> str:
-    # Tokenize input
-    inputs = summarization_tokenizer(text, return_tensors="pt").to(device)
-    token_count = len(inputs[0])
+    return summarize_batch([text], params)[0]
 
-    bad_words_ids = [
-        summarization_tokenizer(bad_word, add_special_tokens=False).input_ids
-        for bad_word in params["bad_words"]
-    ]
+
+class StopEvent(StoppingCriteria):
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+
+def stream_generate(model, tokenizer, skip_prompt: bool, **generate_kwargs):
+    """
+    Runs generate in a thread and yields the decoded text as it is produced.
+    Streamers only support one sequence at a time and no beam search.
+    Generation stops when the consumer closes the generator, e.g. when the
+    client disconnects.
+    """
+    streamer = TextIteratorStreamer(
+        tokenizer, skip_prompt=skip_prompt, skip_special_tokens=True
+    )
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            with torch.inference_mode():
+                model.generate(
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([StopEvent(stop)]),
+                    **generate_kwargs,
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=run, name="generate-stream", daemon=True)
+    thread.start()
+    try:
+        yield from streamer
+    finally:
+        stop.set()
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def stream_summary(text: str, params: dict):
+    """
+    Yields the summary of a text as it is generated, with greedy decoding.
+    Chunks of long texts are summarized and streamed one after the other,
+    unless they are reduced, in which case only the reduce pass is streamed.
+    """
+    max_length = get_summarization_max_length()
+    max_tokens = max_length - summarization_tokenizer.num_special_tokens_to_add()
+    chunks = plan_summary_chunks(text, max_tokens)
+
+    if len(chunks) > 1 and params.get("reduce"):
+        summary = summarize_chunks(text, {**params, "reduce": False})
+        if len(summary) < len(text):
+            yield from stream_summary(summary, params)
+        else:
+            yield summary
+        return
+
+    chunk_params = params.copy()
+    if len(chunks) > 1:
+        chunk_params["max_length"] = int(params["max_length"]) // len(chunks)
+        chunk_params["min_length"] = int(params["min_length"]) // len(chunks)
+
+    for i, chunk in enumerate(chunks):
+        if i > 0:
+            yield " "
+        inputs = tokenize_summary_input([chunk])
+        yield from stream_generate(
+            summarization_transformer,
+            summarization_tokenizer,
+            skip_prompt=True,
+            num_beams=1,
+            **get_summarization_kwargs(inputs, chunk_params),
+        )
+
+
+# Token counts of the messages seen in the last incremental call for each chat
+incremental_message_tokens = OrderedDict()
+incremental_message_tokens_lock = threading.Lock()
+
+
+def count_message_tokens(chat_id: str, messages: list) -> list:
+    with incremental_message_tokens_lock:
+        known = incremental_message_tokens.pop(chat_id, {})
+    hashes = [cache_key(message) for message in messages]
+    unknown = [i for i, h in enumerate(hashes) if h not in known]
+
+    if unknown:
+        token_ids = summarization_tokenizer(
+            [messages[i] for i in unknown], add_special_tokens=False
+        ).input_ids
+        for i, ids in zip(unknown, token_ids):
+            known[hashes[i]] = len(ids)
+
+    with incremental_message_tokens_lock:
+        incremental_message_tokens[chat_id] = {h: known[h] for h in hashes}
+        while len(incremental_message_tokens) > MAX_INCREMENTAL_SUMMARY_CHATS:
+            incremental_message_tokens.popitem(last=False)
+
+    return [known[h] for h in hashes]
+
+
+def plan_message_chunks(chat_id: str, messages: list, chunk_tokens: int) -> list:
+    # Greedy packing from the start of the chat keeps earlier chunks stable
+    # when new messages are appended, so only the tail chunks change
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for message, length in zip(messages, count_message_tokens(chat_id, messages)):
+        if length > chunk_tokens:
+            parts = plan_summary_chunks(message, chunk_tokens)
+        else:
+            parts = [message]
+        for part in parts:
+            part_tokens = min(length, chunk_tokens)
+            if current and current_tokens + part_tokens > chunk_tokens:
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+            current.append(part)
+            current_tokens += part_tokens
+
+    if current:
+        chunks.append("\n".join(current))
+
+    return chunks
+
+
+def summarize_incremental(chat_id: str, messages: list, params: dict) -> dict:
+    max_tokens = (
+        get_summarization_max_length()
+        - summarization_tokenizer.num_special_tokens_to_add()
+    )
+    chunk_tokens = min(int(params["chunk_tokens"]), max_tokens)
+    chunks = plan_message_chunks(chat_id, messages, chunk_tokens)
+
+    # Chunk summaries are scaled to the chunk size, not the chat length,
+    # so that a stable chunk always maps to the same cache entry
+    chunk_params = params.copy()
+    chunk_params["max_length"] = max(
+        1, int(params["max_length"]) * chunk_tokens // max_tokens
+    )
+    chunk_params["min_length"] = int(params["min_length"]) * chunk_tokens // max_tokens
+    params_key = repr(sorted(chunk_params.items()))
+    summarized = []
+
+    def summarize_missing(texts: list) -> list:
+        summarized.extend(texts)
+        summaries = []
+        for start in range(0, len(texts), max_batch_size):
+            summaries.extend(
+                summarize_batch(texts[start : start + max_batch_size], chunk_params)
+            )
+        return summaries
+
+    summaries = result_cache.map(
+        "summarize-chunk",
+        [
+            cache_key(summarization_model + quantized_suffix, params_key, chunk)
+            for chunk in chunks
+        ],
+        chunks,
+        summarize_missing,
+    )
+    summary = " ".join(summaries)
+
+    if params.get("reduce") and len(summaries) > 1:
+        summary = result_cache.get_or_compute(
+            "summarize-reduce",
+            cache_key(
+                summarization_model + quantized_suffix,
+                repr(sorted(params.items())),
+                summary,
+            ),
+            lambda: summarize_chunks(summary, params),
+        )
+
+    return {"summary": summary, "chunks": len(chunks), "summarized": len(summarized)}
+
+
+def tokenize_summary_input(texts: list):
+    return summarization_tokenizer(
+        texts,
+        return_tensors="pt",
+        padding=True,
+        truncation=True,
+        max_length=get_summarization_max_length(),
+    ).to(device)
+
+
+def get_summarization_kwargs(inputs, params: dict) -> dict:
+    token_counts = inputs["attention_mask"].sum(dim=1).tolist()
+    bad_words_ids = get_bad_words_ids(tuple(params["bad_words"]))
+    return {
+        "input_ids": inputs["input_ids"],
+        "attention_mask": inputs["attention_mask"],
+        "max_new_tokens": max(max(token_counts), int(params["max_length"])),
+        "min_new_tokens": min(min(token_counts), int(params["min_length"])),
+        "repetition_penalty": float(params["repetition_penalty"]),
+        "temperature": float(params["temperature"]),
+        "length_penalty": float(params["length_penalty"]),
+        "bad_words_ids": bad_words_ids if bad_words_ids else None,
+    }
+
+
+def summarize_batch(texts: list, params: dict) -> list:
+    inputs = tokenize_summary_input(texts)
     summary_ids = summarization_transformer.generate(
-        inputs["input_ids"],
-        num_beams=2,
-        max_new_tokens=max(token_count, int(params["max_length"])),
-        min_new_tokens=min(token_count, int(params["min_length"])),
-        repetition_penalty=float(params["repetition_penalty"]),
-        temperature=float(params["temperature"]),
-        length_penalty=float(params["length_penalty"]),
-        bad_words_ids=bad_words_ids,
-    )
-    summary = summarization_tokenizer.batch_decode(
+        num_beams=2, **get_summarization_kwargs(inputs, params)
+    )
+    summaries = summarization_tokenizer.batch_decode(
         summary_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True
-    )[0]
-    summary = normalize_string(summary)
-    return summary
+    )
+    return [normalize_string(summary) for summary in summaries]
 
 
 def normalize_string(input: str) -> str:
@@ -340,12 +1478,26 @@ def normalize_string(input: str) -> str:
     return output
 
 
-def extract_keywords(text: str) -> list:
+def prepare_keywords_text(text: str) -> str:
     punctuation = "(){}[]\n\r<>"
     trans = str.maketrans(punctuation, " " * len(punctuation))
     text = text.translate(trans)
-    text = normalize_string(text)
-    return list(keyphrase_pipe(text))
+    return normalize_string(text)
+
+
+def extract_keywords(text: str) -> list:
+    return result_cache.get_or_compute(
+        "keywords",
+        cache_key(keyphrase_model + quantized_suffix, text),
+        lambda: list(keyphrase_pipe(prepare_keywords_text(text))),
+    )
+
+
+def extract_keywords_batch(texts: list) -> list:
+    outputs = keyphrase_pipe(
+        [prepare_keywords_text(text) for text in texts], batch_size=len(texts)
+    )
+    return [list(output) for output in outputs]
 
 
 def generate_prompt(keywords: list, length: int = 100, num: int = 4) -> str:
@@ -363,48 +1515,406 @@ def generate_prompt(keywords: list, length: int = 100, num: int = 4) -> str:
     return [out["generated_text"] for out in outs]
 
 
-def generate_image(data: dict) -> Image:
+def stream_prompts(keywords: list, length: int = 100, num: int = 4):
+    """
+    Yields (index, text) pairs of the prompts as they are generated. The
+    prompts are generated one after the other, since streamers only
+    support one sequence at a time.
+    """
+    prompt = ", ".join(keywords)
+    inputs = gpt_tokenizer(prompt, return_tensors="pt").to(gpt_model.device)
+    for index in range(num):
+        for text in stream_generate(
+            gpt_model,
+            gpt_tokenizer,
+            skip_prompt=False,
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_length=length,
+            do_sample=True,
+            repetition_penalty=1.2,
+            temperature=0.7,
+            top_k=4,
+            pad_token_id=gpt_tokenizer.eos_token_id,
+        ):
+            yield index, text
+
+
+def parse_image_request(data: dict) -> dict:
+    required_fields = {
+        "prompt": str,
+    }
+
+    optional_fields = {
+        "steps": 30,
+        "scale": 6,
+        "sampler": "DDIM",
+        "width": 512,
+        "height": 512,
+        "restore_faces": False,
+        "enable_hr": False,
+        "prompt_prefix": PROMPT_PREFIX,
+        "negative_prompt": NEGATIVE_PROMPT,
+    }
+
+    # Check required fields
+    for field, field_type in required_fields.items():
+        if field not in data or not isinstance(data[field], field_type):
+            abort(400, f'"{field}" is required')
+
+    # Set optional fields to default values if not provided
+    for field, default_value in optional_fields.items():
+        type_match = (
+            (int, float)
+            if isinstance(default_value, (int, float))
+            else type(default_value)
+        )
+        if field not in data or not isinstance(data[field], type_match):
+            data[field] = default_value
+
+    num_images = data.get("num_images", 1)
+    if not isinstance(num_images, int) or not 1 <= num_images <= SD_MAX_IMAGES:
+        abort(400, f'"num_images" must be an integer from 1 to {SD_MAX_IMAGES}')
+
+    # Seeds are picked at random unless "seeds" or a "seed" >= 0 is given
+    seeds = data.get("seeds")
+    if seeds is not None:
+        if not isinstance(seeds, list) or not 1 <= len(seeds) <= SD_MAX_IMAGES:
+            abort(400, f'"seeds" must be a list of 1 to {SD_MAX_IMAGES} integers')
+        num_images = len(seeds)
+    elif isinstance(data.get("seed"), int) and data["seed"] >= 0:
+        seeds = [data["seed"] + i for i in range(num_images)]
+    if seeds is not None and not all(
+        isinstance(seed, int) and 0 <= seed <= SD_MAX_SEED for seed in seeds
+    ):
+        abort(400, f"Seeds must be integers from 0 to {SD_MAX_SEED}")
+
+    data["num_images"] = num_images
+    data["seeds"] = seeds
+    data.pop("seed", None)
+    return data
+
+
+@contextmanager
+def remote_sd_progress(job: Job):
+    """
+    Polls the progress of the remote backend while a job runs on it, and
+    interrupts the backend when the job is cancelled.
+    """
+    finished = threading.Event()
+
+    def poll():
+        interrupted = False
+        while not finished.wait(SD_PROGRESS_INTERVAL):
+            try:
+                if job.is_cancelled() and not interrupted:
+                    sd_remote.interrupt()
+                    interrupted = True
+                state = sd_remote.get_progress().get("state", {})
+                if state.get("sampling_steps"):
+                    job.set_progress(state["sampling_step"], state["sampling_steps"])
+            except Exception as e:
+                print("Could not poll the remote SD progress:", e)
+
+    thread = threading.Thread(target=poll, name="sd-progress", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        finished.set()
+        thread.join()
+
+
+def remote_txt2img(data: dict, prompt: str, seed: int, batch_size: int):
+    result = sd_remote.txt2img(
+        prompt=prompt,
+        negative_prompt=data["negative_prompt"],
+        sampler_name=data["sampler"],
+        steps=data["steps"],
+        cfg_scale=data["scale"],
+        width=data["width"],
+        height=data["height"],
+        restore_faces=data["restore_faces"],
+        enable_hr=data["enable_hr"],
+        seed=seed,
+        batch_size=batch_size,
+        save_images=True,
+        send_images=True,
+        do_not_save_grid=False,
+        do_not_save_samples=False,
+    )
+    # Older backends don't report the seeds they picked
+    seeds = result.info.get("all_seeds") if isinstance(result.info, dict) else None
+    images = result.images[:batch_size]
+    if not seeds:
+        seeds = [seed + i if seed >= 0 else -1 for i in range(len(images))]
+    return images, seeds
+
+
+def generate_remote_images(data: dict, prompt: str, job: Job = None):
+    seeds = data["seeds"]
+    with remote_sd_progress(job) if job is not None else nullcontext():
+        # The backend numbers the images of a batch from the first seed on
+        if seeds is None or seeds == list(range(seeds[0], seeds[0] + len(seeds))):
+            return remote_txt2img(
+                data, prompt, seeds[0] if seeds else -1, data["num_images"]
+            )
+        images = []
+        for seed in seeds:
+            if job is not None and job.is_cancelled():
+                raise JobCancelled()
+            images.extend(remote_txt2img(data, prompt, seed, 1)[0])
+        return images, seeds
+
+
+def generate_local_images(data: dict, prompt: str, seeds: list, job: Job = None):
+    """
+    Generates one image per seed in a single batch. Every image has its own
+    generator, used for its initial latents and for the noise the ancestral
+    scheduler adds at each step, so an image only depends on its seed and
+    not on the rest of the batch.
+    """
+    generators = [torch.Generator().manual_seed(seed) for seed in seeds]
+    scale_factor = getattr(sd_pipe, "vae_scale_factor", 8)
+    shape = (
+        1,
+        sd_pipe.unet.config.in_channels,
+        data["height"] // scale_factor,
+        data["width"] // scale_factor,
+    )
+    latents = torch.cat(
+        [torch.randn(shape, generator=generator) for generator in generators]
+    ).to(sd_device, sd_pipe.unet.dtype)
+
+    output = sd_pipe(
+        prompt=prompt,
+        negative_prompt=data["negative_prompt"],
+        num_inference_steps=data["steps"],
+        guidance_scale=data["scale"],
+        width=data["width"],
+        height=data["height"],
+        num_images_per_prompt=len(seeds),
+        generator=generators,
+        latents=latents,
+        callback=(lambda step, *_: job.set_progress(step + 1, data["steps"]))
+        if job is not None
+        else None,
+        is_cancelled_callback=job.is_cancelled if job is not None else None,
+    )
+    # The pipeline returns nothing when it was cancelled
+    if output is None:
+        raise JobCancelled()
+    return output.images
+
+
+def generate_cached_images(data: dict, prompt: str, seeds: list, job: Job = None):
+    """
+    Images are cached one by one, so only the seeds of a request that were
+    not generated before with the same parameters are generated.
+    """
+    params_key = repr(
+        sorted(
+            (key, value)
+            for key, value in data.items()
+            if key not in ("seeds", "num_images")
+        )
+    )
+    encoded = sd_image_cache.map(
+        "sd",
+        [cache_key(sd_model, params_key, seed) for seed in seeds],
+        seeds,
+        lambda missing: [
+            encode_image(image, format="png")
+            for image in generate_local_images(data, prompt, missing, job)
+        ],
+    )
+    images = [Image.open(BytesIO(image)) for image in encoded]
+    # Opened images decode lazily, and are shared with the debug image thread
+    for image in images:
+        image.load()
+    return images
+
+
+def generate_images(data: dict, job: Job = None) -> dict:
     prompt = normalize_string(f'{data["prompt_prefix"]} {data["prompt"]}')
 
     if sd_use_remote:
-        image = sd_remote.txt2img(
-            prompt=prompt,
-            negative_prompt=data["negative_prompt"],
-            sampler_name=data["sampler"],
-            steps=data["steps"],
-            cfg_scale=data["scale"],
-            width=data["width"],
-            height=data["height"],
-            restore_faces=data["restore_faces"],
-            enable_hr=data["enable_hr"],
-            save_images=True,
-            send_images=True,
-            do_not_save_grid=False,
-            do_not_save_samples=False,
-        ).image
+        images, seeds = generate_remote_images(data, prompt, job)
     else:
-        image = sd_pipe(
-            prompt=prompt,
-            negative_prompt=data["negative_prompt"],
-            num_inference_steps=data["steps"],
-            guidance_scale=data["scale"],
-            width=data["width"],
-            height=data["height"],
-        ).images[0]
-
-    image.save("./debug.png")
-    return image
+        seeds = data["seeds"]
+        if seeds is None:
+            # Random seeds are never requested again, so they are not cached
+            seeds = [randint(0, SD_MAX_SEED) for _ in range(data["num_images"])]
+            images = generate_local_images(data, prompt, seeds, job)
+        else:
+            images = generate_cached_images(data, prompt, seeds, job)
+
+    if job is not None and job.is_cancelled():
+        raise JobCancelled()
+
+    if args.sd_debug_image:
+        threading.Thread(
+            target=images[0].save, args=(SD_DEBUG_IMAGE_PATH,), name="sd-debug-image"
+        ).start()
+    return {"images": images, "seeds": seeds}
+
+
+def run_image_job(job: Job) -> dict:
+    with model_registry.use("sd"):
+        print("SD inputs:", job.data, sep="\n")
+        return generate_images(job.data, job)
+
+
+sd_jobs = (
+    JobQueue(
+        run_image_job,
+        max_size=args.sd_queue_size if args.sd_queue_size else DEFAULT_SD_QUEUE_SIZE,
+        history=SD_JOB_HISTORY,
+        name="sd-jobs",
+    )
+    if "sd" in modules
+    else None
+)
+
+
+# Response options, which are not part of the image parameters
+IMAGE_OPTIONS = ("format", "quality", "max_size", "raw", "index")
+
+
+def submit_image_job(data: dict) -> Job:
+    for name in IMAGE_OPTIONS:
+        data.pop(name, None)
+    priority = data.pop("priority", 0)
+    if not isinstance(priority, int):
+        abort(400, '"priority" must be an integer')
+    try:
+        return sd_jobs.submit(parse_image_request(data), priority)
+    except queue.Full:
+        abort(503, "The image queue is full, try again later")
+
+
+def get_image_job(job_id: str) -> Job:
+    if sd_jobs is None:
+        abort(403, "Module is disabled by config")
+    job = sd_jobs.get(job_id)
+    if job is None:
+        abort(404, "Job not found")
+    return job
+
+
+def get_image_job_result(job: Job) -> dict:
+    if job.state == "failed":
+        abort(400, job.error)
+    if job.state == "cancelled":
+        abort(410, "The job was cancelled")
+    if not job.done:
+        abort(409, "The job is not finished")
+    return job.result
+
+
+def get_image_options(default_quality: int, allow_raw: bool = True) -> dict:
+    """
+    Reads how the images of a response are encoded: "format" (jpeg, webp or
+    png), "quality" (1 to 100), "max_size" (longest side in pixels), and
+    whether the raw bytes of one image are sent instead of base64 in JSON.
+    Raw bytes are sent with "raw" or when the Accept header prefers an image
+    type to JSON, and that type is then the default format. Responses that
+    are always JSON pass `allow_raw=False`, which rejects "raw" and "index".
+    """
+    accepted_format = None
+    if allow_raw:
+        accepted = request.accept_mimetypes.best_match(
+            ["application/json"] + [image_mimetype(name) for name in IMAGE_FORMATS]
+        )
+        accepted_format = next(
+            (name for name in IMAGE_FORMATS if image_mimetype(name) == accepted),
+            None,
+        )
+    else:
+        for name in ("raw", "index"):
+            if get_option(name) is not None:
+                abort(400, f'"{name}" is not supported by this endpoint')
+
+    format = get_option("format")
+    if format is None:
+        format = accepted_format or "jpeg"
+    elif not isinstance(format, str) or normalize_image_format(format) is None:
+        abort(400, f'"format" must be one of {", ".join(IMAGE_FORMATS)}')
+    options = {
+        # Formats this Pillow build can't encode fall back to JPEG
+        "format": normalize_image_format(format) or "jpeg",
+        "quality": get_int_option("quality", default_quality, 1, 100),
+        "max_size": get_int_option("max_size", None, 1, 16384),
+    }
+    if allow_raw:
+        options["raw"] = get_flag("raw") or accepted_format is not None
+        options["index"] = get_int_option("index", 0, 0, SD_MAX_IMAGES - 1)
+    return options
+
+
+def encode_images(images: list, options: dict) -> list:
+    return image_encoder.encode_many(
+        images,
+        format=options["format"],
+        quality=options["quality"],
+        max_size=options["max_size"],
+    )
+
+
+def image_to_base64(image: Image, options: dict) -> str:
+    return base64.b64encode(encode_images([image], options)[0]).decode("utf-8")
+
+
+def send_image_result(result: dict, options: dict):
+    images, seeds = result["images"], result["seeds"]
+
+    if options["raw"]:
+        index = options["index"]
+        if index >= len(images):
+            abort(400, f'"index" must be less than {len(images)}')
+        data = encode_images([images[index]], options)[0]
+        response = send_file(BytesIO(data), mimetype=image_mimetype(options["format"]))
+        response.headers["X-Image-Seed"] = str(seeds[index])
+        return response
+
+    encoded = [
+        base64.b64encode(data).decode("utf-8")
+        for data in encode_images(images, options)
+    ]
+    return jsonify(
+        {
+            "image": encoded[0],
+            "images": encoded,
+            "seeds": seeds,
+            "type": image_mimetype(options["format"]),
+        }
+    )
+
+
+def transcribe_segments(audio, beam_size: int = None):
+    if parallel_transcriber is not None:
+        from faster_whisper.audio import decode_audio
 
+        audio = decode_audio(audio, sampling_rate=SAMPLE_RATE)
+        if parallel_transcriber.should_split(audio):
+            print(
+                f"Transcribing {len(audio) / SAMPLE_RATE:.0f}s of audio",
+                f"across {parallel_transcriber.workers} workers",
+            )
+            return parallel_transcriber.transcribe(audio)
 
-def image_to_base64(image: Image, quality: int = 75) -> str:
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG", quality=quality)
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    return img_str
+    segments, info = transcribe_model.transcribe(
+        audio,
+        beam_size=beam_size if beam_size else transcribe_beam_size,
+        vad_filter=args.transcribe_vad,
+    )
+    return segments, transcription_info(
+        info.language, info.language_probability, info.duration
+    )
 
 
-def transcribe(audio, beam_size: int = 5):
-    segments, info = transcribe_model.transcribe(audio, beam_size=beam_size)
+def transcribe(audio, beam_size: int = None):
+    segments, info = transcribe_segments(audio, beam_size)
     result = ""
 
     for segment in segments:
@@ -417,6 +1927,20 @@ def transcribe(audio, beam_size: int = 5):
     return (result, info)
 
 
+# Dynamic batching of concurrent requests
+batchers = {}
+
+if "classify" in modules:
+    batchers["classify"] = MicroBatcher(
+        classify_texts, max_batch_size, batch_window / 1000, "classify"
+    )
+
+if "caption" in modules:
+    batchers["caption"] = MicroBatcher(
+        caption_batch, max_batch_size, batch_window / 1000, "caption"
+    )
+
+
 @app.before_request
 # Request time measuring
 def before_request():
@@ -456,22 +1980,60 @@ def get_extensions():
     return jsonify(extensions)
 
 
+def decode_caption_image(stream) -> Image:
+    image = Image.open(stream)
+    # Lets JPEGs decode at a reduced scale that still covers the thumbnail
+    image.draft("RGB", (512, 512))
+    image = image.convert("RGB")
+    image.thumbnail((512, 512))
+    return image
+
+
 @app.route("/api/caption", methods=["POST"])
 @require_module("caption")
 def api_caption():
-    data = request.get_json()
+    uploads = get_uploads("image")
 
-    if "image" not in data or not isinstance(data["image"], str):
+    if len(uploads) != 1:
         abort(400, '"image" is required')
 
-    image = Image.open(BytesIO(base64.b64decode(data["image"])))
-    image = image.convert("RGB")
-    image.thumbnail((512, 512))
+    options = get_image_options(THUMBNAIL_QUALITY, allow_raw=False)
+    image = decode_caption_image(uploads[0])
     caption = caption_image(image)
-    thumbnail = image_to_base64(image)
+    thumbnail = image_to_base64(image, options)
     print("Caption:", caption, sep="\n")
     gc.collect()
-    return jsonify({"caption": caption, "thumbnail": thumbnail})
+    return jsonify(
+        {
+            "caption": caption,
+            "thumbnail": thumbnail,
+            "thumbnail_type": image_mimetype(options["format"]),
+        }
+    )
+
+
+@app.route("/api/caption/batch", methods=["POST"])
+@require_module("caption")
+def api_caption_batch():
+    uploads = get_uploads("images")
+
+    if len(uploads) == 0:
+        abort(400, '"images" is required')
+
+    images = [decode_caption_image(upload) for upload in uploads]
+    captions = result_cache.map(
+        "caption",
+        [caption_cache_key(image, 20) for image in images],
+        images,
+        lambda images: [
+            caption
+            for start in range(0, len(images), max_batch_size)
+            for caption in caption_images(images[start : start + max_batch_size])
+        ],
+    )
+    print("Captions:", captions, sep="\n")
+    gc.collect()
+    return jsonify({"captions": captions})
 
 
 @app.route("/api/summarize", methods=["POST"])
@@ -488,12 +2050,60 @@ def api_summarize():
         params.update(data["params"])
 
     print("Summary input:", data["text"], sep="\n")
+
+    if get_flag("stream"):
+
+        def generate():
+            summary = ""
+            for text in stream_summary(data["text"], params):
+                summary += text
+                yield sse_event({"text": text}, event="token")
+            summary = normalize_string(summary)
+            print("Summary output:", summary, sep="\n")
+            yield sse_event({"summary": summary}, event="done")
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
     summary = summarize_chunks(data["text"], params)
     print("Summary output:", summary, sep="\n")
     gc.collect()
     return jsonify({"summary": summary})
 
 
+@app.route("/api/summarize/incremental", methods=["POST"])
+@require_module("summarize")
+def api_summarize_incremental():
+    data = request.get_json()
+
+    if "chat_id" not in data or not isinstance(data["chat_id"], str):
+        abort(400, '"chat_id" is required')
+    if not is_text_list(data.get("messages")):
+        abort(400, '"messages" is required')
+
+    params = DEFAULT_SUMMARIZE_PARAMS.copy()
+    params["chunk_tokens"] = DEFAULT_INCREMENTAL_CHUNK_TOKENS
+
+    if "params" in data and isinstance(data["params"], dict):
+        params.update(data["params"])
+    chunk_tokens = params["chunk_tokens"]
+    if (
+        not isinstance(chunk_tokens, int)
+        or isinstance(chunk_tokens, bool)
+        or chunk_tokens < 1
+    ):
+        abort(400, '"chunk_tokens" must be a positive integer')
+
+    print("Incremental summary input:", len(data["messages"]), "messages")
+    result = summarize_incremental(data["chat_id"], data["messages"], params)
+    print(
+        f"Summarized {result['summarized']} of {result['chunks']} chunks:",
+        result["summary"],
+        sep="\n",
+    )
+    gc.collect()
+    return jsonify(result)
+
+
 @app.route("/api/classify", methods=["POST"])
 @require_module("classify")
 def api_classify():
@@ -512,9 +2122,29 @@ def api_classify():
 @app.route("/api/classify/labels", methods=["GET"])
 @require_module("classify")
 def api_classify_labels():
-    classification = classify_text("")
-    labels = [x["label"] for x in classification]
-    return jsonify({"labels": labels})
+    return jsonify({"labels": classification_labels})
+
+
+@app.route("/api/classify/batch", methods=["POST"])
+@require_module("classify")
+def api_classify_batch():
+    data = request.get_json()
+
+    if not isinstance(data, dict) or not is_text_list(data.get("texts")):
+        abort(400, '"texts" is required')
+
+    print("Classification batch input:", len(data["texts"]), "texts")
+    classification = result_cache.map(
+        "classify",
+        [
+            cache_key(classification_model + quantized_suffix, text)
+            for text in data["texts"]
+        ],
+        data["texts"],
+        lambda texts: run_length_sorted(classify_texts, texts, max_batch_size),
+    )
+    gc.collect()
+    return jsonify({"classification": classification})
 
 
 @app.route("/api/keywords", methods=["POST"])
@@ -531,8 +2161,27 @@ def api_keywords():
     return jsonify({"keywords": keywords})
 
 
+@app.route("/api/keywords/batch", methods=["POST"])
+@require_module("keywords")
+def api_keywords_batch():
+    data = request.get_json()
+
+    if not isinstance(data, dict) or not is_text_list(data.get("texts")):
+        abort(400, '"texts" is required')
+
+    print("Keywords batch input:", len(data["texts"]), "texts")
+    keywords = result_cache.map(
+        "keywords",
+        [cache_key(keyphrase_model + quantized_suffix, text) for text in data["texts"]],
+        data["texts"],
+        lambda texts: run_length_sorted(extract_keywords_batch, texts, max_batch_size),
+    )
+    return jsonify({"keywords": keywords})
+
+
 @app.route("/api/prompt", methods=["POST"])
 @require_module("prompt")
+@require_module("keywords")
 def api_prompt():
     data = request.get_json()
 
@@ -545,6 +2194,21 @@ def api_prompt():
         keywords.insert(0, data["name"])
 
     print("Prompt input:", data["text"], sep="\n")
+
+    if get_flag("stream"):
+
+        def generate():
+            prompts = []
+            for index, text in stream_prompts(keywords):
+                if index == len(prompts):
+                    prompts.append("")
+                prompts[index] += text
+                yield sse_event({"index": index, "text": text}, event="token")
+            print("Prompt output:", prompts, sep="\n")
+            yield sse_event({"prompts": prompts}, event="done")
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
     prompts = generate_prompt(keywords)
     print("Prompt output:", prompts, sep="\n")
     return jsonify({"prompts": prompts})
@@ -553,46 +2217,48 @@ def api_prompt():
 @app.route("/api/image", methods=["POST"])
 @require_module("sd")
 def api_image():
-    required_fields = {
-        "prompt": str,
-    }
+    options = get_image_options(SD_IMAGE_QUALITY)
+    job = submit_image_job(request.get_json())
+    job.wait()
+    return send_image_result(get_image_job_result(job), options)
 
-    optional_fields = {
-        "steps": 30,
-        "scale": 6,
-        "sampler": "DDIM",
-        "width": 512,
-        "height": 512,
-        "restore_faces": False,
-        "enable_hr": False,
-        "prompt_prefix": PROMPT_PREFIX,
-        "negative_prompt": NEGATIVE_PROMPT,
-    }
 
-    data = request.get_json()
+@app.route("/api/image/jobs", methods=["POST"])
+@require_module("sd")
+def api_image_job_submit():
+    job = submit_image_job(request.get_json())
+    status = job.to_dict()
+    status["position"] = sd_jobs.position(job)
+    return jsonify(status), 202
 
-    # Check required fields
-    for field, field_type in required_fields.items():
-        if field not in data or not isinstance(data[field], field_type):
-            abort(400, f'"{field}" is required')
 
-    # Set optional fields to default values if not provided
-    for field, default_value in optional_fields.items():
-        type_match = (
-            (int, float)
-            if isinstance(default_value, (int, float))
-            else type(default_value)
-        )
-        if field not in data or not isinstance(data[field], type_match):
-            data[field] = default_value
+@app.route("/api/image/jobs/<job_id>", methods=["GET"])
+def api_image_job_status(job_id: str):
+    job = get_image_job(job_id)
+    status = job.to_dict()
+    if job.state == "queued":
+        status["position"] = sd_jobs.position(job)
+    return jsonify(status)
 
-    try:
-        print("SD inputs:", data, sep="\n")
-        image = generate_image(data)
-        base64image = image_to_base64(image, quality=90)
-        return jsonify({"image": base64image})
-    except RuntimeError as e:
-        abort(400, str(e))
+
+@app.route("/api/image/jobs/<job_id>/result", methods=["GET"])
+def api_image_job_result(job_id: str):
+    options = get_image_options(SD_IMAGE_QUALITY)
+    result = get_image_job_result(get_image_job(job_id))
+    return send_image_result(result, options)
+
+
+@app.route("/api/image/jobs/<job_id>/cancel", methods=["POST"])
+def api_image_job_cancel(job_id: str):
+    job = get_image_job(job_id)
+    return jsonify({"cancelled": sd_jobs.cancel(job.id), "state": job.state})
+
+
+@app.route("/api/image/jobs", methods=["GET"])
+def api_image_job_stats():
+    if sd_jobs is None:
+        abort(403, "Module is disabled by config")
+    return jsonify(sd_jobs.get_stats())
 
 
 @app.route("/api/image/model", methods=["POST"])
@@ -609,6 +2275,8 @@ def api_image_model_set():
     sd_remote.util_set_model(data["model"], find_closest=False)
     # sd_remote.util_set_model(data['model'])
     sd_remote.util_wait_for_ready()
+    # The cached model lists may have changed with the model
+    sd_remote.invalidate()
     new_model = sd_remote.util_get_current_model()
 
     return jsonify({"previous_model": old_model, "current_model": new_model})
@@ -649,10 +2317,41 @@ def api_image_samplers():
 
 @app.route("/api/modules", methods=["GET"])
 def get_modules():
-    return jsonify({"modules": modules})
+    return jsonify(
+        {
+            "modules": modules,
+            "resident": model_registry.resident(),
+            "models": model_registry.get_status(),
+        }
+    )
+
+
+@app.route("/api/health/startup", methods=["GET"])
+def get_startup_health():
+    status = model_registry.get_startup_status()
+    status["quantization"] = quantization_reports
+    return jsonify(status)
+
+
+@app.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    stats = result_cache.get_stats()
+    if sd_image_cache.enabled:
+        stats["sd"] = sd_image_cache.get_stats()
+    if tts_cache is not None:
+        stats["tts"] = tts_cache.get_stats()
+    if sd_remote is not None:
+        stats["sd_remote"] = sd_remote.get_stats()
+    return jsonify(stats)
+
+
+@app.route("/api/batching/stats", methods=["GET"])
+def get_batching_stats():
+    return jsonify({name: batcher.get_stats() for name, batcher in batchers.items()})
 
 
 @app.route("/api/tts/speakers", methods=["GET"])
+@require_module("tts")
 def tts_speakers():
     voices = [
         {
@@ -665,26 +2364,149 @@ def tts_speakers():
     return jsonify(voices)
 
 
-@app.route("/api/tts/generate", methods=["POST"])
+def read_audio(audio) -> bytes:
+    if hasattr(audio, "read"):
+        return audio.read()
+    with open(audio, "rb") as f:
+        return f.read()
+
+
+def synthesize_tts(speaker: str, text: str) -> bytes:
+    # Silero writes every narration to the same file, so it is read before
+    # another request can overwrite it
+    with tts_lock:
+        return read_audio(tts_service.generate(speaker, text))
+
+
+tts_lock = threading.Lock()
+
+
+def generate_tts(speaker: str, text: str):
+    """
+    Returns a WAV file object with the narrated text and the key of the text
+    in the TTS cache.
+    """
+    key = cache_key(tts_model_id, speaker, normalize_string(text))
+
+    if tts_cache is None:
+        return BytesIO(synthesize_tts(speaker, text)), key
+
+    # The cached file is opened right away, since another request can evict
+    # it from the cache before it is sent
+    audio = tts_cache.open(key)
+    if audio is None:
+        data = synthesize_tts(speaker, text)
+        tts_cache.set(key, data)
+        audio = BytesIO(data)
+    return audio, key
+
+
+def split_sentences(text: str) -> list:
+    sentences = re.split(r"(?<=[.!?…])\s+|\n+", text)
+    return [s.strip() for s in sentences if any(c.isalnum() for c in s)]
+
+
+def wav_stream_header(channels: int, sample_width: int, frame_rate: int) -> bytes:
+    # The sizes are unknown while streaming, so they are set to the maximum
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        0xFFFFFFFF,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        channels,
+        frame_rate,
+        frame_rate * channels * sample_width,
+        channels * sample_width,
+        sample_width * 8,
+        b"data",
+        0xFFFFFFFF,
+    )
+
+
+def stream_tts(speaker: str, text: str):
+    """
+    Narrates the text sentence by sentence on a background thread and yields
+    one WAV header followed by the audio frames of each sentence as soon as
+    it is ready, while the next sentences are still being synthesized.
+    """
+    sentences = split_sentences(text)
+    results = queue.Queue()
+    stopped = threading.Event()
+
+    def synthesize():
+        for sentence in sentences:
+            if stopped.is_set():
+                return
+            try:
+                audio, _ = generate_tts(speaker, sentence)
+                results.put(read_audio(audio))
+            except Exception as e:
+                results.put(e)
+                return
+
+    threading.Thread(target=synthesize, name="tts-stream", daemon=True).start()
+
+    def generate():
+        header_sent = False
+        try:
+            for _ in sentences:
+                result = results.get()
+                if isinstance(result, Exception):
+                    raise result
+                with wave.open(BytesIO(result)) as wav:
+                    if not header_sent:
+                        yield wav_stream_header(
+                            wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+                        )
+                        header_sent = True
+                    yield wav.readframes(wav.getnframes())
+        finally:
+            # Stops synthesizing when the client goes away
+            stopped.set()
+
+    return generate()
+
+
+@app.route("/api/tts/generate", methods=["GET", "POST"])
+@require_module("tts")
 def tts_generate():
-    voice = request.get_json()
+    voice = request.get_json() if request.method == "POST" else request.args
     if "text" not in voice or not isinstance(voice["text"], str):
         abort(400, '"text" is required')
     if "speaker" not in voice or not isinstance(voice["speaker"], str):
         abort(400, '"speaker" is required')
     # Remove asterisks
-    voice["text"] = voice["text"].replace("*", "")
+    text = voice["text"].replace("*", "")
+
+    if get_flag("stream"):
+        # A stream without sentences would not even have a WAV header
+        if not split_sentences(text):
+            abort(400, '"text" has nothing to narrate')
+        return Response(stream_tts(voice["speaker"], text), mimetype="audio/x-wav")
+
     try:
-        audio = tts_service.generate(voice["speaker"], voice["text"])
-        return send_file(audio, mimetype="audio/x-wav")
+        audio, key = generate_tts(voice["speaker"], text)
+        return send_file(
+            audio,
+            mimetype="audio/x-wav",
+            etag=key,
+            conditional=True,
+            max_age=TTS_AUDIO_MAX_AGE,
+        )
     except Exception as e:
         print(e)
         abort(500, voice["speaker"])
 
 
 @app.route("/api/tts/sample/<speaker>", methods=["GET"])
+@require_module("tts")
 def tts_play_sample(speaker: str):
-    return send_from_directory(SILERO_SAMPLES_PATH, f"{speaker}.wav")
+    return send_from_directory(
+        SILERO_SAMPLES_PATH, f"{speaker}.wav", max_age=TTS_AUDIO_MAX_AGE
+    )
 
 
 @app.route("/api/chromadb", methods=["POST"])
@@ -696,25 +2518,30 @@ def chromadb_add_messages():
     if "messages" not in data or not isinstance(data["messages"], list):
         abort(400, '"messages" is required')
 
-    chat_id_md5 = hashlib.md5(data["chat_id"].encode()).hexdigest()
-    collection = chromadb_client.get_or_create_collection(
-        name=f"chat-{chat_id_md5}", embedding_function=chromadb_embed_fn
-    )
-
     documents = [m["content"] for m in data["messages"]]
     ids = [m["id"] for m in data["messages"]]
     metadatas = [
-        {"role": m["role"], "date": m["date"], "meta": m.get("meta", "")}
+        {
+            "role": m["role"],
+            "date": m["date"],
+            "meta": m.get("meta", ""),
+            "hash": hashlib.md5(m["content"].encode()).hexdigest(),
+        }
         for m in data["messages"]
     ]
 
-    collection.upsert(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas,
+    result = vector_store.add_messages(
+        data["chat_id"], ids, documents, metadatas, chromadb_embed_fn
     )
+    if ids:
+        chromadb_dirty.set()
+    return jsonify(result)
 
-    return jsonify({"count": len(ids)})
+
+@app.route("/api/chromadb/stats", methods=["GET"])
+@require_module("chromadb")
+def chromadb_stats():
+    return jsonify(vector_store.get_stats())
 
 
 @app.route("/api/chromadb/purge", methods=["POST"])
@@ -724,13 +2551,9 @@ def chromadb_purge():
     if "chat_id" not in data or not isinstance(data["chat_id"], str):
         abort(400, '"chat_id" is required')
 
-    chat_id_md5 = hashlib.md5(data["chat_id"].encode()).hexdigest()
-    collection = chromadb_client.get_or_create_collection(
-        name=f"chat-{chat_id_md5}", embedding_function=chromadb_embed_fn
-    )
-
-    deleted = collection.delete()
-    print("ChromaDB embeddings deleted", len(deleted))
+    deleted = vector_store.purge(data["chat_id"])
+    chromadb_dirty.set()
+    print("ChromaDB embeddings deleted", deleted)
     return 'Ok', 200
 
 
@@ -740,7 +2563,15 @@ def chromadb_query():
     data = request.get_json()
     if "chat_id" not in data or not isinstance(data["chat_id"], str):
         abort(400, '"chat_id" is required')
-    if "query" not in data or not isinstance(data["query"], str):
+
+    # A list of "queries" is answered with a list of results per query
+    if "queries" in data:
+        if not is_text_list(data["queries"]) or len(data["queries"]) == 0:
+            abort(400, '"queries" must be a list of strings')
+        queries = data["queries"]
+    elif "query" in data and isinstance(data["query"], str):
+        queries = [data["query"]]
+    else:
         abort(400, '"query" is required')
 
     if "n_results" not in data or not isinstance(data["n_results"], int):
@@ -748,61 +2579,129 @@ def chromadb_query():
     else:
         n_results = data["n_results"]
 
-    chat_id_md5 = hashlib.md5(data["chat_id"].encode()).hexdigest()
-    collection = chromadb_client.get_or_create_collection(
-        name=f"chat-{chat_id_md5}", embedding_function=chromadb_embed_fn
-    )
+    where = data.get("where")
+    if where is not None and not isinstance(where, dict):
+        abort(400, '"where" must be an object')
+
+    use_mmr = bool(data.get("mmr", False))
+    mmr_lambda = data.get("mmr_lambda", DEFAULT_MMR_LAMBDA)
+    if (
+        not isinstance(mmr_lambda, (int, float))
+        or isinstance(mmr_lambda, bool)
+        or not 0 <= mmr_lambda <= 1
+    ):
+        abort(400, '"mmr_lambda" must be a number from 0 to 1')
+    if "fetch_k" not in data or not isinstance(data["fetch_k"], int):
+        fetch_k = n_results * DEFAULT_MMR_FETCH_FACTOR
+    else:
+        fetch_k = data["fetch_k"]
 
-    n_results = min(collection.count(), n_results)
-    query_result = collection.query(
-        query_texts=[data["query"]],
-        n_results=n_results,
-    )
+    count = vector_store.count(data["chat_id"])
+    n_fetch = min(count, max(n_results, fetch_k) if use_mmr else n_results)
 
-    documents = query_result["documents"][0]
-    ids = query_result["ids"][0]
-    metadatas = query_result["metadatas"][0]
-    distances = query_result["distances"][0]
+    if n_fetch <= 0:
+        results = [[] for _ in queries]
+        return jsonify(results if "queries" in data else results[0])
 
-    messages = [
-        {
-            "id": ids[i],
-            "date": metadatas[i]["date"],
-            "role": metadatas[i]["role"],
-            "meta": metadatas[i]["meta"],
-            "content": documents[i],
-            "distance": distances[i],
-        }
-        for i in range(len(ids))
-    ]
+    query_embeddings = chromadb_embed_fn(queries)
+    try:
+        query_result = vector_store.query(
+            data["chat_id"],
+            query_embeddings,
+            n_fetch,
+            where=where,
+            include_embeddings=use_mmr,
+        )
+    except ValueError as e:
+        abort(400, str(e))
+
+    results = []
+    for q in range(len(queries)):
+        documents = query_result["documents"][q]
+        ids = query_result["ids"][q]
+        metadatas = query_result["metadatas"][q]
+        distances = query_result["distances"][q]
+        indices = list(range(min(n_results, len(ids))))
+
+        if use_mmr and len(ids) > 0:
+            indices = mmr_rerank(
+                np.asarray(query_embeddings[q], dtype=np.float32),
+                np.asarray(query_result["embeddings"][q], dtype=np.float32),
+                n_results,
+                mmr_lambda,
+            )
+
+        results.append(
+            [
+                {
+                    "id": ids[i],
+                    "date": metadatas[i]["date"],
+                    "role": metadatas[i]["role"],
+                    "meta": metadatas[i]["meta"],
+                    "content": documents[i],
+                    "distance": distances[i],
+                }
+                for i in indices
+            ]
+        )
 
-    return jsonify(messages)
+    return jsonify(results if "queries" in data else results[0])
 
 
 @app.route("/api/transcribe", methods=["POST"])
 @require_module("transcribe")
 def transcribe_query():
-    data = request.get_json()
-    if "audio" not in data:
+    uploads = get_uploads("audio")
+    if len(uploads) != 1:
         abort(400, '"audio" is required')
-    
-    audio = BytesIO(base64.b64decode(data['audio']))
-    result, info = transcribe(audio=audio)
+
+    if get_flag("stream"):
+        segments, info = transcribe_segments(audio=uploads[0])
+
+        def generate():
+            result = ""
+            for segment in segments:
+                result += segment.text
+                yield sse_event(
+                    {"start": segment.start, "end": segment.end, "text": segment.text},
+                    event="segment",
+                )
+            print("Transcription: ", result)
+            yield sse_event({"result": result, "info": info}, event="done")
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+
+    result, info = transcribe(audio=uploads[0])
     gc.collect()
     return jsonify({'result': result, 'info': info})
 
 
+# Models loading
+if not args.lazy_load:
+    model_registry.preload(
+        [name for name in modules if name in model_registry],
+        args.startup_workers if args.startup_workers else DEFAULT_STARTUP_WORKERS,
+    )
+    if not args.serve_while_loading:
+        model_registry.wait_for_preload()
+
+if args.model_idle_ttl is not None or args.model_memory_budget:
+    model_registry.start_sweeper(
+        min(args.model_idle_ttl / 2, 30) if args.model_idle_ttl is not None else 30
+    )
+
 if args.share:
     from flask_cloudflared import _run_cloudflared
     import inspect
 
     sig = inspect.signature(_run_cloudflared)
-    sum = sum(
+    # Not named "sum" to keep the builtin usable in lazily called loaders
+    positional_count = sum(
         1
         for param in sig.parameters.values()
         if param.kind == param.POSITIONAL_OR_KEYWORD
     )
-    if sum > 1:
+    if positional_count > 1:
         metrics_port = randint(8100, 9000)
         cloudflare = _run_cloudflared(port, metrics_port)
     else:
@@ -0,0 +1,164 @@
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Length of the frames used to find the quietest cut point
+FRAME_SIZE = int(0.03 * SAMPLE_RATE)
+
+Segment = namedtuple("Segment", ["start", "end", "text"])
+
+
+def transcription_info(
+    language: str, language_probability: float, duration: float, windows: int = 1
+) -> dict:
+    """The "info" of a transcription, whether it was split or not."""
+    return {
+        "language": language,
+        "language_probability": language_probability,
+        "duration": duration,
+        "windows": windows,
+    }
+
+
+_worker_model = None
+_worker_options = None
+
+
+def _init_worker(model_name: str, compute_type: str, cpu_threads: int, options: dict):
+    global _worker_model, _worker_options
+    from faster_whisper import WhisperModel
+
+    _worker_model = WhisperModel(
+        model_name, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads
+    )
+    _worker_options = options
+
+
+def _transcribe_window(audio: np.ndarray):
+    segments, info = _worker_model.transcribe(audio, **_worker_options)
+    return (
+        [(s.start, s.end, s.text) for s in segments],
+        info.language,
+        info.language_probability,
+    )
+
+
+def _ping():
+    return True
+
+
+def split_windows(audio: np.ndarray, window: int, overlap: int, search: int) -> list:
+    """
+    Cuts the audio at the quietest frame in the last `search` samples of every
+    `window` samples. Returns (start, end, core_start, core_end) sample
+    offsets, where each window is padded by `overlap` samples on both sides
+    of its core.
+    """
+    frames = len(audio) // FRAME_SIZE
+    energy = np.sqrt(
+        np.mean(audio[: frames * FRAME_SIZE].reshape(frames, FRAME_SIZE) ** 2, axis=1)
+    )
+    cuts = [0]
+
+    while len(audio) - cuts[-1] > window:
+        low = (cuts[-1] + max(FRAME_SIZE, window - search)) // FRAME_SIZE
+        high = min((cuts[-1] + window) // FRAME_SIZE, frames)
+        quietest = low + int(np.argmin(energy[low:high])) if high > low else high
+        cut = quietest * FRAME_SIZE
+        # Windows shorter than a few frames can leave nothing to search, and
+        # the cut must still move forward
+        cuts.append(cut if cut > cuts[-1] else cuts[-1] + window)
+
+    cuts.append(len(audio))
+    return [
+        (
+            max(0, cuts[i] - overlap),
+            min(len(audio), cuts[i + 1] + overlap),
+            cuts[i],
+            cuts[i + 1],
+        )
+        for i in range(len(cuts) - 1)
+    ]
+
+
+class ParallelTranscriber:
+    """
+    Transcribes long recordings by splitting them at silences into
+    overlapping windows and transcribing the windows in a pool of worker
+    processes, each with its own WhisperModel on the CPU.
+
+    Worker processes are forked, since spawning them would re-run the
+    server script, so this is only available on platforms with fork.
+    Forking a process that runs other threads can leave the locks they
+    hold (imports, OpenMP, the allocator) locked forever in the children,
+    so the workers are started when this is created, which must happen
+    before the server starts any thread. Starting them starts the threads
+    of the pool, so no other pool can be forked after it.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        workers: int,
+        compute_type: str,
+        cpu_threads: int,
+        window: float,
+        overlap: float,
+        options: dict,
+    ):
+        self.workers = workers
+        self.window = int(window * SAMPLE_RATE)
+        self.overlap = int(overlap * SAMPLE_RATE)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(model_name, compute_type, cpu_threads, options),
+        )
+        # Forks every worker now, they load their models in the background
+        self.executor.submit(_ping)
+
+    @staticmethod
+    def is_supported() -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    def wait_for_ready(self):
+        self.executor.submit(_ping).result()
+
+    def should_split(self, audio: np.ndarray) -> bool:
+        return len(audio) > self.window
+
+    def transcribe(self, audio: np.ndarray):
+        """
+        Returns an iterator over the stitched segments in order, and the
+        transcription_info of the first window's language. The iterator
+        yields as soon as the windows before it are finished.
+        """
+        windows = split_windows(audio, self.window, self.overlap, self.window // 4)
+        futures = [
+            self.executor.submit(_transcribe_window, audio[start:end])
+            for start, end, _, _ in windows
+        ]
+        first_segments, language, language_probability = futures[0].result()
+        info = transcription_info(
+            language, language_probability, len(audio) / SAMPLE_RATE, len(windows)
+        )
+
+        def segments():
+            for i, ((start, _, core_start, core_end), future) in enumerate(
+                zip(windows, futures)
+            ):
+                results = first_segments if i == 0 else future.result()[0]
+                offset = start / SAMPLE_RATE
+                last = i == len(windows) - 1
+                for seg_start, seg_end, text in results:
+                    # Segments in the overlap belong to the window whose core
+                    # contains their midpoint
+                    middle = (offset + (seg_start + seg_end) / 2) * SAMPLE_RATE
+                    if core_start <= middle and (middle < core_end or last):
+                        yield Segment(offset + seg_start, offset + seg_end, text)
+
+        return segments(), info
@@ -0,0 +1,756 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def chat_collection_name(chat_id: str) -> str:
+    return f"chat-{hashlib.md5(chat_id.encode()).hexdigest()}"
+
+
+def empty_query_result(queries: int) -> dict:
+    return {
+        key: [[] for _ in range(queries)]
+        for key in ["ids", "documents", "metadatas", "distances", "embeddings"]
+    }
+
+
+_COMPARISONS = {"$gt", "$gte", "$lt", "$lte"}
+_OPERATORS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: is_number(a) and a > b,
+    "$gte": lambda a, b: is_number(a) and a >= b,
+    "$lt": lambda a, b: is_number(a) and a < b,
+    "$lte": lambda a, b: is_number(a) and a <= b,
+    "$in": lambda a, b: a in b,
+    "$nin": lambda a, b: a not in b,
+}
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_where(where: dict):
+    """Raises ValueError if a metadata filter can't be evaluated."""
+    if not isinstance(where, dict):
+        raise ValueError("Where filters must be objects")
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list):
+                raise ValueError(f"{key} expects a list of filters")
+            for c in condition:
+                validate_where(c)
+        elif isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator not in _OPERATORS:
+                    raise ValueError(f"Unsupported where operator {operator}")
+                if operator in _COMPARISONS and not is_number(operand):
+                    raise ValueError(f"{operator} expects a number")
+                if operator in ("$in", "$nin") and not isinstance(operand, list):
+                    raise ValueError(f"{operator} expects a list")
+
+
+def matches_where(metadata: dict, where: dict) -> bool:
+    """
+    Evaluates a ChromaDB style metadata filter against one message. The
+    filter is checked with validate_where first.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if not _OPERATORS[operator](value, operand):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def mmr_rerank(
+    query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float
+) -> list:
+    """
+    Maximal marginal relevance: picks k candidates that are similar to the
+    query but not to the candidates picked before them. Returns their indices.
+    """
+    # Zero vectors are kept at zero instead of dividing by zero
+    eps = np.finfo(np.float32).eps
+    candidates = candidates / np.maximum(
+        np.linalg.norm(candidates, axis=1, keepdims=True), eps
+    )
+    relevance = candidates @ (query / max(np.linalg.norm(query), eps))
+    similarity = candidates @ candidates.T
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+
+    return selected
+
+
+class ChatEntry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.handle = None
+        self.last_used = time.monotonic()
+        self.memory = 0
+        self.closed = False
+
+
+class VectorStore:
+    """
+    Per-chat store of message embeddings behind the /api/chromadb routes.
+    Distances are squared L2, as in ChromaDB.
+
+    Backends open a handle per chat with get, upsert, query, count, delete,
+    memory and close methods. Handles are opened on first use and paged out
+    with close() when they stay idle longer than `idle_ttl` seconds, or when
+    the open handles exceed `memory_budget` bytes, least recently used first.
+    The next request to a paged out chat opens it again.
+    """
+
+    name = None
+
+    def __init__(self, idle_ttl: float = None, memory_budget: int = None):
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        # Least recently used first
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.loads = 0
+        self.idle_evictions = 0
+        self.budget_evictions = 0
+
+    def _open(self, chat_id: str):
+        raise NotImplementedError
+
+    @contextmanager
+    def _use(self, chat_id: str):
+        while True:
+            with self._lock:
+                entry = self._chats.get(chat_id)
+                if entry is None:
+                    entry = self._chats[chat_id] = ChatEntry()
+                self._chats.move_to_end(chat_id)
+            with entry.lock:
+                # Evicted while this request was waiting for it
+                if entry.closed:
+                    continue
+                if entry.handle is None:
+                    entry.handle = self._open(chat_id)
+                    self.loads += 1
+                entry.last_used = time.monotonic()
+                try:
+                    yield entry.handle
+                finally:
+                    entry.last_used = time.monotonic()
+                break
+        self.enforce_budget(exclude=chat_id)
+
+    def get(self, chat_id: str, ids: list) -> dict:
+        """Returns the "ids", "metadatas" and "embeddings" of stored ids."""
+        with self._use(chat_id) as chat:
+            return chat.get(ids)
+
+    def upsert(
+        self,
+        chat_id: str,
+        ids: list,
+        documents: list,
+        metadatas: list,
+        embeddings: list,
+    ):
+        with self._use(chat_id) as chat:
+            chat.upsert(ids, documents, metadatas, embeddings)
+
+    def query(
+        self,
+        chat_id: str,
+        query_embeddings: list,
+        n_results: int,
+        where: dict = None,
+        include_embeddings: bool = False,
+    ) -> dict:
+        """
+        Returns the nearest messages of every query embedding, as lists of
+        "ids", "documents", "metadatas", "distances" and "embeddings" with
+        one entry per query, nearest first.
+        """
+        with self._use(chat_id) as chat:
+            return chat.query(query_embeddings, n_results, where, include_embeddings)
+
+    def count(self, chat_id: str) -> int:
+        with self._use(chat_id) as chat:
+            return chat.count()
+
+    def purge(self, chat_id: str) -> int:
+        """Deletes every message of a chat. Returns how many were deleted."""
+        with self._use(chat_id) as chat:
+            return chat.delete()
+
+    def evict(self, chat_id: str) -> bool:
+        with self._lock:
+            entry = self._chats.get(chat_id)
+        # Never wait for a chat that is being used
+        if entry is None or not entry.lock.acquire(blocking=False):
+            return False
+        try:
+            if entry.handle is not None:
+                entry.handle.close()
+                entry.handle = None
+            entry.closed = True
+            with self._lock:
+                if self._chats.get(chat_id) is entry:
+                    del self._chats[chat_id]
+            return True
+        finally:
+            entry.lock.release()
+
+    def evict_idle(self):
+        if self.idle_ttl is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                chat_id
+                for chat_id, entry in self._chats.items()
+                if now - entry.last_used > self.idle_ttl
+            ]
+        for chat_id in idle:
+            if self._try_evict(chat_id):
+                self.idle_evictions += 1
+
+    def _try_evict(self, chat_id: str) -> bool:
+        try:
+            return self.evict(chat_id)
+        except Exception as e:
+            print(f"Could not page out chat {chat_id}:", e)
+            return False
+
+    def _resident(self) -> list:
+        with self._lock:
+            entries = list(self._chats.items())
+        resident = []
+        for chat_id, entry in entries:
+            # A chat in use keeps the memory it had when it was last measured
+            if entry.lock.acquire(blocking=False):
+                try:
+                    if entry.handle is None:
+                        continue
+                    entry.memory = entry.handle.memory()
+                finally:
+                    entry.lock.release()
+            elif entry.closed:
+                continue
+            resident.append((chat_id, entry.memory))
+        return resident
+
+    def resident_memory(self) -> int:
+        return sum(memory for _, memory in self._resident())
+
+    def enforce_budget(self, exclude: str = None):
+        if self.memory_budget is None:
+            return
+        resident = self._resident()
+        total = sum(memory for _, memory in resident)
+        for chat_id, memory in resident:
+            if total <= self.memory_budget:
+                break
+            if chat_id != exclude and self._try_evict(chat_id):
+                self.budget_evictions += 1
+                total -= memory
+
+    def start_sweeper(self, interval: float):
+        def sweep():
+            while not self._stop.wait(interval):
+                try:
+                    self.evict_idle()
+                    self.enforce_budget()
+                except Exception as e:
+                    print("Could not page out idle chats:", e)
+
+        threading.Thread(target=sweep, name="vector-store-sweeper", daemon=True).start()
+
+    def get_stats(self) -> dict:
+        resident = self._resident()
+        now = time.monotonic()
+        with self._lock:
+            last_used = [entry.last_used for entry in self._chats.values()]
+        return {
+            "backend": self.name,
+            "resident_chats": len(resident),
+            "resident_memory": sum(memory for _, memory in resident),
+            "memory_budget": self.memory_budget,
+            "idle_ttl": self.idle_ttl,
+            "max_idle_seconds": now - min(last_used) if last_used else None,
+            "loads": self.loads,
+            "idle_evictions": self.idle_evictions,
+            "budget_evictions": self.budget_evictions,
+        }
+
+    def add_messages(
+        self, chat_id: str, ids: list, documents: list, metadatas: list, embed_fn
+    ) -> dict:
+        """
+        Stores messages, embedding only the new or edited ones. Messages are
+        compared with the stored ones by the content hash in their "hash"
+        metadata, and unchanged messages whose other metadata changed are
+        updated with their stored embedding.
+        """
+        existing = self.get(chat_id, ids)
+        stored = {
+            id: (metadata, embedding)
+            for id, metadata, embedding in zip(
+                existing["ids"], existing["metadatas"], existing["embeddings"]
+            )
+        }
+        embed_indices = [
+            i
+            for i, id in enumerate(ids)
+            if id not in stored or stored[id][0].get("hash") != metadatas[i]["hash"]
+        ]
+        upsert_indices = [
+            i
+            for i, id in enumerate(ids)
+            if id not in stored or stored[id][0] != metadatas[i]
+        ]
+        embeddings = {i: stored[ids[i]][1] for i in upsert_indices if ids[i] in stored}
+
+        if embed_indices:
+            vectors = embed_fn([documents[i] for i in embed_indices])
+            for i, vector in zip(embed_indices, vectors):
+                embeddings[i] = vector.tolist() if hasattr(vector, "tolist") else vector
+
+        if upsert_indices:
+            self.upsert(
+                chat_id,
+                ids=[ids[i] for i in upsert_indices],
+                documents=[documents[i] for i in upsert_indices],
+                metadatas=[metadatas[i] for i in upsert_indices],
+                embeddings=[embeddings[i] for i in upsert_indices],
+            )
+
+        embedded = sum(1 for i in embed_indices if ids[i] not in stored)
+        return {
+            "count": len(ids),
+            "embedded": embedded,
+            "updated": len(embed_indices) - embedded,
+            "metadata_updated": len(upsert_indices) - len(embed_indices),
+            "skipped": len(ids) - len(upsert_indices),
+        }
+
+    def persist(self):
+        pass
+
+    def close(self):
+        """Persists the store and forgets its handles without paging them out."""
+        self._stop.set()
+        self.persist()
+        with self._lock:
+            for entry in self._chats.values():
+                entry.closed = True
+            self._chats.clear()
+
+
+class NumpyChatIndex:
+    """
+    Embeddings of one chat as a memory-mapped float32 matrix, with the ids,
+    documents and metadata in a JSON sidecar. The matrix grows by doubling,
+    so only the first `len(ids)` rows are in use.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._load()
+
+    def _load(self):
+        self.ids = []
+        self.documents = []
+        self.metadatas = []
+        self.positions = {}
+        self.dim = None
+        self.capacity = 0
+        self.vectors = None
+        self.norms = np.zeros(0, dtype=np.float32)
+
+        if os.path.exists(self._sidecar_path):
+            with open(self._sidecar_path, "r", encoding="utf-8") as f:
+                sidecar = json.load(f)
+            self.ids = sidecar["ids"]
+            self.documents = sidecar["documents"]
+            self.metadatas = sidecar["metadatas"]
+            self.dim = sidecar["dim"]
+            self.capacity = sidecar["capacity"]
+            self.positions = {id: i for i, id in enumerate(self.ids)}
+            if self.capacity > 0:
+                self.vectors = np.memmap(
+                    self._vectors_path,
+                    dtype=np.float32,
+                    mode="r+",
+                    shape=(self.capacity, self.dim),
+                )
+                used = self.vectors[: len(self.ids)]
+                self.norms = np.einsum("ij,ij->i", used, used)
+
+    @property
+    def _sidecar_path(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    def _reserve(self, rows: int):
+        if rows <= self.capacity:
+            return
+        capacity = max(16, self.capacity * 2, rows)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self.vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(capacity, self.dim),
+        )
+        self.capacity = capacity
+
+    def _write_sidecar(self):
+        temp_path = f"{self._sidecar_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "capacity": self.capacity,
+                    "ids": self.ids,
+                    "documents": self.documents,
+                    "metadatas": self.metadatas,
+                },
+                f,
+            )
+        os.replace(temp_path, self._sidecar_path)
+
+    def get(self, ids: list) -> dict:
+        rows = [self.positions[id] for id in ids if id in self.positions]
+        return {
+            "ids": [self.ids[row] for row in rows],
+            "metadatas": [self.metadatas[row] for row in rows],
+            "embeddings": [self.vectors[row].tolist() for row in rows],
+        }
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {embeddings.shape[1]} does not match {self.dim}"
+            )
+
+        rows = []
+        for id, document, metadata in zip(ids, documents, metadatas):
+            row = self.positions.get(id)
+            if row is None:
+                row = self.positions[id] = len(self.ids)
+                self.ids.append(id)
+                self.documents.append(document)
+                self.metadatas.append(metadata)
+            else:
+                self.documents[row] = document
+                self.metadatas[row] = metadata
+            rows.append(row)
+
+        self._reserve(len(self.ids))
+        self.vectors[rows] = embeddings
+        self.vectors.flush()
+        norms = np.zeros(len(self.ids), dtype=np.float32)
+        norms[: len(self.norms)] = self.norms
+        norms[rows] = np.einsum("ij,ij->i", embeddings, embeddings)
+        self.norms = norms
+        self._write_sidecar()
+
+    def query(self, query_embeddings, n_results, where=None, include_embeddings=False):
+        if where:
+            validate_where(where)
+        result = empty_query_result(len(query_embeddings))
+        if not self.ids or n_results <= 0:
+            return result
+
+        if where:
+            rows = np.array(
+                [i for i, m in enumerate(self.metadatas) if matches_where(m, where)],
+                dtype=np.int64,
+            )
+            if len(rows) == 0:
+                return result
+            candidates = self.vectors[rows]
+            norms = self.norms[rows]
+        else:
+            rows = None
+            candidates = self.vectors[: len(self.ids)]
+            norms = self.norms
+
+        # Squared L2 distances of every query to every candidate
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        distances = (
+            norms[None, :]
+            - 2 * queries @ candidates.T
+            + np.einsum("ij,ij->i", queries, queries)[:, None]
+        )
+        k = min(n_results, len(norms))
+        if k < len(norms):
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.tile(np.arange(len(norms)), (len(queries), 1))
+
+        for q in range(len(queries)):
+            order = nearest[q][np.argsort(distances[q, nearest[q]])]
+            positions = rows[order] if rows is not None else order
+            result["ids"][q] = [self.ids[i] for i in positions]
+            result["documents"][q] = [self.documents[i] for i in positions]
+            result["metadatas"][q] = [self.metadatas[i] for i in positions]
+            result["distances"][q] = [max(0.0, float(d)) for d in distances[q, order]]
+            if include_embeddings:
+                result["embeddings"][q] = candidates[order].tolist()
+        return result
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def memory(self) -> int:
+        documents = sum(len(document) for document in self.documents)
+        return self.capacity * (self.dim or 0) * 4 + self.norms.nbytes + documents
+
+    def flush(self):
+        if self.vectors is not None:
+            self.vectors.flush()
+
+    def close(self):
+        self.flush()
+        self.vectors = None
+
+    def delete(self) -> int:
+        count = len(self.ids)
+        self.vectors = None
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._load()
+        return count
+
+
+class ChromaChat:
+    """
+    Collection of one chat. Closing it spills the collection to a
+    NumpyChatIndex under `spill_path` and drops it from ChromaDB, opening
+    it again restores the spilled messages.
+
+    With `keep_spill`, the spill of a restored chat is kept until
+    discard_spill() is called once a persisted ChromaDB holds the chat again.
+    """
+
+    def __init__(
+        self,
+        client,
+        name: str,
+        embedding_function,
+        spill_path: str,
+        keep_spill: bool = False,
+    ):
+        self.client = client
+        self.name = name
+        self.spill_path = os.path.join(spill_path, name) if spill_path else None
+        self.collection = client.get_or_create_collection(
+            name=name, embedding_function=embedding_function
+        )
+        self.dim = None
+        self._count = None
+        self.restored = False
+
+        if self.spill_path is None:
+            return
+        # A spill interrupted before it replaced the previous one is ignored
+        temp_path = f"{self.spill_path}.tmp"
+        if not os.path.exists(self.spill_path) and os.path.exists(temp_path):
+            os.replace(temp_path, self.spill_path)
+        if os.path.exists(self.spill_path):
+            spilled = NumpyChatIndex(self.spill_path)
+            if spilled.ids:
+                self.collection.upsert(
+                    ids=spilled.ids,
+                    documents=spilled.documents,
+                    metadatas=spilled.metadatas,
+                    embeddings=spilled.vectors[: len(spilled.ids)].tolist(),
+                )
+                self.dim = spilled.dim
+            spilled.close()
+            self.restored = True
+            if not keep_spill:
+                self.discard_spill()
+
+    def get(self, ids: list) -> dict:
+        return self.collection.get(ids=ids, include=["metadatas", "embeddings"])
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        self.collection.upsert(
+            ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings
+        )
+        self.dim = len(embeddings[0]) if embeddings else self.dim
+        self._count = None
+
+    def query(self, query_embeddings, n_results, where=None, include_embeddings=False):
+        include = ["documents", "metadatas", "distances"]
+        self.dim = len(query_embeddings[0]) if query_embeddings else self.dim
+        # ChromaDB returns empty lists when the filter matches nothing, and
+        # clamps n_results to the messages that match
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where if where else None,
+            include=include + ["embeddings"] if include_embeddings else include,
+        )
+
+    def count(self) -> int:
+        if self._count is None:
+            self._count = self.collection.count()
+        return self._count
+
+    def memory(self) -> int:
+        # Estimate: the embeddings are held by both the database and the index
+        return self.count() * (self.dim or 0) * 4 * 2
+
+    def delete(self) -> int:
+        # delete() returns None since chromadb 0.3.26
+        count = self.collection.count()
+        self.collection.delete()
+        self._count = None
+        return count
+
+    def discard_spill(self):
+        shutil.rmtree(self.spill_path, ignore_errors=True)
+        self.restored = False
+
+    def close(self):
+        if self.spill_path is None:
+            return
+        data = self.collection.get(include=["documents", "metadatas", "embeddings"])
+        # Replaces a spill that was kept since the chat was restored
+        temp_path = f"{self.spill_path}.tmp"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if data["ids"]:
+            spilled = NumpyChatIndex(temp_path)
+            spilled.upsert(
+                data["ids"], data["documents"], data["metadatas"], data["embeddings"]
+            )
+            spilled.close()
+        shutil.rmtree(self.spill_path, ignore_errors=True)
+        if os.path.exists(temp_path):
+            os.replace(temp_path, self.spill_path)
+        self.client.delete_collection(self.name)
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    ChromaDB collection per chat. Paged out chats are spilled to
+    `spill_path`, or only their handles are dropped if it is None.
+
+    A persistent store keeps the spill of a restored chat until the next
+    persist(), so the chat survives a restart before it is persisted again.
+    """
+
+    name = "chromadb"
+
+    def __init__(
+        self,
+        client,
+        embedding_function,
+        persistent: bool = False,
+        spill_path: str = None,
+        idle_ttl: float = None,
+        memory_budget: int = None,
+    ):
+        super().__init__(idle_ttl, memory_budget)
+        self.client = client
+        self.embedding_function = embedding_function
+        self.persistent = persistent
+        self.spill_path = spill_path
+
+    def _open(self, chat_id: str) -> ChromaChat:
+        return ChromaChat(
+            self.client,
+            chat_collection_name(chat_id),
+            self.embedding_function,
+            self.spill_path,
+            keep_spill=self.persistent,
+        )
+
+    def persist(self):
+        if not self.persistent:
+            return
+        with self._lock:
+            entries = list(self._chats.values())
+        restored = [
+            (entry, entry.handle)
+            for entry in entries
+            if entry.handle is not None and entry.handle.restored
+        ]
+        self.client.persist()
+        for entry, handle in restored:
+            with entry.lock:
+                # Spilled again since, the spill holds its latest messages
+                if entry.handle is handle:
+                    handle.discard_spill()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Lightweight in-process backend: exact top-k search over a memory-mapped
+    NumPy matrix per chat, stored in a directory per chat under `path`.
+    Every change is written through, so paging a chat out only unmaps it.
+    """
+
+    name = "numpy"
+
+    def __init__(self, path: str, idle_ttl: float = None, memory_budget: int = None):
+        super().__init__(idle_ttl, memory_budget)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _open(self, chat_id: str) -> NumpyChatIndex:
+        return NumpyChatIndex(os.path.join(self.path, chat_collection_name(chat_id)))
+
+    def stored_chats(self) -> int:
+        return sum(
+            1
+            for name in os.listdir(self.path)
+            if os.path.isdir(os.path.join(self.path, name))
+        )
+
+    def persist(self):
+        with self._lock:
+            entries = list(self._chats.values())
+        for entry in entries:
+            with entry.lock:
+                if entry.handle is not None:
+                    entry.handle.flush()